@@ -0,0 +1,134 @@
+import os
+import re
+import tempfile
+from typing import Dict, List, Tuple
+from parse_cache import partition_cached
+
+# Page-level triage: only pages with real images or tables go through the (10-50x slower)
+# hi_res model; plain-text pages use the fast text-layer strategy.
+MIN_IMAGE_PIXELS = 100 * 100   # Ignore icons/logos/bullets, they are filtered out later anyway
+MIN_RULING_OPS = 12            # Stroked lines/rectangles that suggest a ruled table
+MIN_NUMERIC_ROWS = 3           # Text rows with 3+ numeric cells that suggest a borderless table
+
+_NUMERIC_CELL = re.compile(r"(?<![\w.])[-+]?\d+(?:[.,]\d+)?%?(?![\w.])")
+_RULING_OP = re.compile(rb"(?:\s|^)(?:re|l)\s")
+
+def _xobject_images(resources, depth: int = 0) -> List[Tuple[int, int]]:
+    """Sizes of image XObjects on a page, looking one level into form XObjects."""
+    sizes = []
+    if not resources or "/XObject" not in resources:
+        return sizes
+    xobjects = resources["/XObject"].get_object()
+    for name in xobjects:
+        obj = xobjects[name].get_object()
+        subtype = obj.get("/Subtype")
+        if subtype == "/Image":
+            sizes.append((int(obj.get("/Width", 0)), int(obj.get("/Height", 0))))
+        elif subtype == "/Form" and depth == 0:
+            sizes.extend(_xobject_images(obj.get("/Resources"), depth + 1))
+    return sizes
+
+def _has_table_signals(page) -> bool:
+    try:
+        contents = page.get_contents()
+        data = contents.get_data() if contents is not None else b""
+    except Exception:
+        data = b""
+    if len(_RULING_OP.findall(data)) >= MIN_RULING_OPS:
+        return True
+
+    try:
+        text = page.extract_text() or ""
+    except Exception:
+        return False
+    numeric_rows = sum(1 for line in text.splitlines() if len(_NUMERIC_CELL.findall(line)) >= 3)
+    return numeric_rows >= MIN_NUMERIC_ROWS
+
+def triage_pages(file_path: str) -> List[str]:
+    """Classifies each page (in order) as 'hi_res' (images/tables) or 'fast' (plain text)."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_path)
+    strategies = []
+    for page in reader.pages:
+        try:
+            images = _xobject_images(page.get("/Resources"))
+        except Exception:
+            images = []
+        has_image = any(w * h >= MIN_IMAGE_PIXELS for w, h in images)
+        strategies.append("hi_res" if has_image or _has_table_signals(page) else "fast")
+    return strategies
+
+def _write_page_subset(file_path: str, page_numbers: List[int]) -> str:
+    """Writes the given 1-based pages to a temporary PDF and returns its path."""
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(file_path)
+    writer = PdfWriter()
+    for page_number in page_numbers:
+        writer.add_page(reader.pages[page_number - 1])
+    fd, subset_path = tempfile.mkstemp(suffix=".pdf", prefix="hi_res_pages_")
+    with os.fdopen(fd, "wb") as f:
+        writer.write(f)
+    return subset_path
+
+def _group_by_page(elements) -> Dict[int, List]:
+    """Buckets elements by page number; elements without one stay with the preceding page."""
+    pages = {}
+    current = 1
+    for el in elements:
+        current = getattr(el.metadata, "page_number", None) or current
+        pages.setdefault(current, []).append(el)
+    return pages
+
+def partition_adaptive(file_path: str, **hi_res_kwargs) -> Tuple[List, dict]:
+    """
+    Partitions a PDF with hi_res only on pages that need it and fast elsewhere.
+    Returns (elements in page order, stats). If the hi_res pass fails, those pages
+    fall back to their fast elements and stats["degraded"] is set, so the result is
+    used for this ingestion but not cached.
+    """
+    from unstructured.partition.pdf import partition_pdf
+
+    page_strategies = triage_pages(file_path)
+    hi_res_pages = [i + 1 for i, s in enumerate(page_strategies) if s == "hi_res"]
+    stats = {
+        "strategy": "adaptive",
+        "total_pages": len(page_strategies),
+        "hi_res_pages": len(hi_res_pages),
+        "fast_pages": len(page_strategies) - len(hi_res_pages)
+    }
+    print(f"🔎 Page triage for {os.path.basename(file_path)}: "
+          f"{stats['hi_res_pages']} hi_res / {stats['fast_pages']} fast pages")
+
+    # The full-document fast parse is shared through the cache (assessments read it too)
+    fast_by_page = _group_by_page(partition_cached(file_path, "fast"))
+
+    hi_res_by_page = {}
+    if hi_res_pages:
+        subset_path = _write_page_subset(file_path, hi_res_pages)
+        try:
+            subset_elements = partition_pdf(filename=subset_path, strategy="hi_res", **hi_res_kwargs)
+            for subset_page, elements in _group_by_page(subset_elements).items():
+                original_page = hi_res_pages[min(subset_page, len(hi_res_pages)) - 1]
+                for el in elements:
+                    el.metadata.page_number = original_page
+                    el.metadata.filename = os.path.basename(file_path)
+                    el.metadata.file_directory = os.path.dirname(file_path)
+                hi_res_by_page.setdefault(original_page, []).extend(elements)
+        except Exception as e:
+            print(f"⚠️ hi_res pass failed, using fast elements for those pages: {e}")
+            stats["fast_pages"] += stats["hi_res_pages"]
+            stats["hi_res_pages"] = 0
+            stats["degraded"] = True
+            hi_res_pages = []
+        finally:
+            os.remove(subset_path)
+
+    merged = []
+    for page_number in sorted(set(fast_by_page) | set(hi_res_by_page)):
+        if page_number in hi_res_pages:
+            merged.extend(hi_res_by_page.get(page_number, []))
+        else:
+            merged.extend(fast_by_page.get(page_number, []))
+    return merged, stats
@@ -0,0 +1,165 @@
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from ingestion_manifest import manifest_path, load_manifest, content_fingerprint
+
+# --- CONFIG ---
+# In-memory semantic cache for Doubt Assistant answers, scoped per (session, language).
+# A query hits when its embedding is close enough to a previously answered one.
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))   # Cosine similarity
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+UPLOAD_ROOT = "uploads"
+
+def _normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+def _file_signature(path: str):
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+_content_fingerprints = {}   # session_id -> (manifest file signature, content fingerprint)
+
+def _session_content_fingerprint(session_id: str) -> Optional[str]:
+    """content_fingerprint of the manifest; the file is only re-read when its stat changes."""
+    directory_path = os.path.join(UPLOAD_ROOT, session_id)
+    signature = _file_signature(manifest_path(directory_path))
+    cached = _content_fingerprints.get(session_id)
+    if cached is None or cached[0] != signature:
+        cached = (signature, content_fingerprint(load_manifest(directory_path)))
+        _content_fingerprints[session_id] = cached
+    return cached[1]
+
+def session_fingerprint(session_id: str) -> Tuple:
+    """
+    Changes whenever the session's ingested content or teacher guidance changes. A no-op
+    ingestion rewrites the manifest but keeps its content fingerprint, so answers survive it.
+    """
+    return (
+        _session_content_fingerprint(session_id),
+        _file_signature(os.path.join(UPLOAD_ROOT, session_id, "teacher_review.json")),
+    )
+
+class AnswerCache:
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, ttl: int = ANSWER_CACHE_TTL_SECONDS,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # entry id -> entry, least recently used first
+        self._buckets = {}              # (session_id, language) -> set of entry ids
+        self._fingerprints = {}         # session_id -> fingerprint the cached answers were built on
+        self._ids = 0
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "expired": 0, "evictions": 0, "invalidations": 0}
+
+    def _drop(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        bucket = self._buckets.get(entry["bucket"])
+        if bucket is not None:
+            bucket.discard(entry_id)
+            if not bucket:
+                del self._buckets[entry["bucket"]]
+
+    def _check_fingerprint(self, session_id: str):
+        """Called with the lock held: drops the session's answers if its content changed."""
+        current = session_fingerprint(session_id)
+        previous = self._fingerprints.get(session_id)
+        if previous is not None and previous != current:
+            self._invalidate(session_id)
+        self._fingerprints[session_id] = current
+
+    def _invalidate(self, session_id: str) -> int:
+        stale = [entry_id for entry_id, entry in self._entries.items() if entry["bucket"][0] == session_id]
+        for entry_id in stale:
+            self._drop(entry_id)
+        if stale:
+            self._stats["invalidations"] += 1
+            print(f"🧹 Answer cache: dropped {len(stale)} answers for session {session_id}")
+        return len(stale)
+
+    def lookup(self, session_id: str, language: str, embedding: List[float]) -> Optional[Dict]:
+        """Best cached answer above the similarity threshold, or None."""
+        query = _normalize(embedding)
+        bucket_key = (session_id, language.lower())
+        now = time.time()
+        with self._lock:
+            self._check_fingerprint(session_id)
+            best_id, best_score = None, self.threshold
+            for entry_id in list(self._buckets.get(bucket_key, ())):
+                entry = self._entries[entry_id]
+                if now - entry["created"] > self.ttl:
+                    self._drop(entry_id)
+                    self._stats["expired"] += 1
+                    continue
+                score = sum(a * b for a, b in zip(query, entry["embedding"]))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self._stats["hits"] += 1
+            entry = self._entries[best_id]
+            return {"answer": entry["answer"], "sources": entry["sources"], "query": entry["query"], "similarity": best_score}
+
+    def store(self, session_id: str, language: str, query: str, embedding: List[float], answer: str,
+              sources: Optional[List[Dict]] = None):
+        bucket_key = (session_id, language.lower())
+        with self._lock:
+            self._check_fingerprint(session_id)
+            self._ids += 1
+            self._entries[self._ids] = {
+                "bucket": bucket_key,
+                "query": query,
+                "embedding": _normalize(embedding),
+                "answer": answer,
+                "sources": sources or [],
+                "created": time.time(),
+            }
+            self._buckets.setdefault(bucket_key, set()).add(self._ids)
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def invalidate_session(self, session_id: str) -> int:
+        with self._lock:
+            self._fingerprints.pop(session_id, None)
+            return self._invalidate(session_id)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "sessions": len({bucket[0] for bucket in self._buckets}),
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl,
+                "max_entries": self.max_entries,
+            }
+
+cache = AnswerCache()
+
+def lookup(session_id: str, language: str, embedding: List[float]) -> Optional[Dict]:
+    return cache.lookup(session_id, language, embedding)
+
+def store(session_id: str, language: str, query: str, embedding: List[float], answer: str,
+          sources: Optional[List[Dict]] = None):
+    cache.store(session_id, language, query, embedding, answer, sources)
+
+def invalidate_session(session_id: str) -> int:
+    return cache.invalidate_session(session_id)
+
+def get_stats() -> Dict:
+    return cache.get_stats()
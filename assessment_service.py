@@ -2,12 +2,17 @@ import os
 import json
 import random
 import time
-from typing import List, Dict, Optional
-from typing import List, Dict, Optional
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage, SystemMessage
+import asyncio
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
 from dotenv import load_dotenv
-from unstructured.partition.pdf import partition_pdf
+from parse_cache import get_document_elements
+from file_utils import atomic_write_json, file_sha256_cached
+import llm_gateway
+import context_packing
+import vector_store
+from ingestion_manifest import load_manifest, find_entry
+from async_utils import run_blocking, SingleFlight, KeyedLocks
 
 load_dotenv(override=True)
 
@@ -20,13 +25,27 @@ COOLDOWN_SECONDS = 600 # 10 Minutes
 
 os.makedirs(ASSESSMENT_DIR, exist_ok=True)
 
-# Initialize Gemini
-llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.3)
+# Gemini calls go through the shared llm_gateway
+LLM_TEMPERATURE = 0.3
+
+# Assessments are stored per (session, chapter content hash, level) under
+# data/assessments/<session_id>/ and pre-generated in the background after ingestion
+ASSESSMENT_LEVELS = (1, 2, 3)
+ASSESSMENT_VERSION = 2   # Bump when the prompts change to invalidate stored assessments
+# Chapter context is sampled from the ingested chunks across all of the chapter's topics
+ASSESSMENT_CONTEXT_TOKENS = int(os.getenv("ASSESSMENT_CONTEXT_TOKENS", "10000"))
+
+# Students opening the same quest at once share one generation
+_assessment_flights = SingleFlight("assessment")
+# ...and share the store key with pre-generation, which runs in a worker thread
+_assessment_locks = KeyedLocks()
+# Teacher preview builds the chapter x level matrix with at most this many generations at once
+TEACHER_BULK_CONCURRENCY = int(os.getenv("TEACHER_BULK_CONCURRENCY", "4"))
 
 def get_session_text(session_id: str) -> str:
     """
     Extracts text from all PDFs in the session directory.
-    Uses unstructured (fast strategy) for speed.
+    Reuses the shared parse cache; uncached files are parsed with the fast strategy.
     """
     session_dir = os.path.join(UPLOAD_ROOT, session_id)
     if not os.path.exists(session_dir):
@@ -37,7 +56,7 @@ def get_session_text(session_id: str) -> str:
         if filename.lower().endswith(".pdf"):
             file_path = os.path.join(session_dir, filename)
             try:
-                elements = partition_pdf(filename=file_path, strategy="fast")
+                elements = get_document_elements(file_path)
                 full_text += "\n".join([str(e) for e in elements])
             except Exception as e:
                 print(f"Error parsing {filename}: {e}")
@@ -63,15 +82,95 @@ def get_sorted_files(session_id: str):
     # Sort: Oldest -> Newest
     return sorted(files, key=lambda x: x["timestamp"])
 
-def get_current_chapter_context(session_id: str, chapter_file: dict) -> str:
-    """Extracts text ONLY from the specific chapter file."""
+def _chunk_index(chunk_id: str) -> int:
+    index = chunk_id.rsplit(":", 1)[-1]
+    return int(index) if index.isdigit() else 0
+
+def chapter_is_ingested(session_id: str, chapter_file: dict) -> bool:
+    """True once the manifest records chunks for this chapter file."""
+    _, entry = find_entry(load_manifest(os.path.join(UPLOAD_ROOT, session_id)), chapter_file["filename"])
+    return bool(entry and entry.get("chunk_ids"))
+
+def load_chapter_chunks(session_id: str, chapter_file: dict) -> List[dict]:
+    """The ingested chunks of one chapter file in document order, with their parent_topic."""
+    db = vector_store.get_session_store(session_id, create=False)
+    if db is None:
+        return []
+    _, entry = find_entry(load_manifest(os.path.join(UPLOAD_ROOT, session_id)), chapter_file["filename"])
+    if entry and entry.get("chunk_ids"):
+        results = db.get(ids=entry["chunk_ids"], include=["documents", "metadatas"])
+        position = {chunk_id: i for i, chunk_id in enumerate(entry["chunk_ids"])}
+    else:
+        where = {"source": chapter_file["filename"]}
+        if vector_store.session_filter(session_id):
+            where = {"$and": [where, vector_store.session_filter(session_id)]}
+        results = db.get(where=where, include=["documents", "metadatas"])
+        # Chunk ids are "<session>:<file hash>:<index>"
+        position = {chunk_id: _chunk_index(chunk_id) for chunk_id in results["ids"]}
+
+    chunks = []
+    for chunk_id, text, metadata in zip(results["ids"], results["documents"], results["metadatas"]):
+        parts = context_packing.split_chunk(text or "")
+        chunks.append({
+            "id": chunk_id,
+            "topic": (metadata or {}).get("parent_topic") or parts["topic"] or "General",
+            "text": parts["raw"] or text or "",
+            "summary": parts["summary"],
+        })
+    chunks.sort(key=lambda c: position.get(c["id"], 0))
+    return chunks
+
+def sample_chapter_context(chunks: List[dict], budget: int = ASSESSMENT_CONTEXT_TOKENS) -> str:
+    """
+    Picks chunks round-robin across parent topics until the token budget is used, so every
+    topic of the chapter is represented (a chunk that does not fit falls back to its summary).
+    The selection is emitted in document order, grouped by topic.
+    """
+    topics = OrderedDict()
+    for position, chunk in enumerate(chunks):
+        topics.setdefault(chunk["topic"], []).append((position, chunk))
+
+    selected = {}   # position -> text
+    used = 0
+    queues = [list(items) for items in topics.values()]
+    while queues and budget - used >= context_packing.MIN_SNIPPET_TOKENS:
+        for queue in queues:
+            position, chunk = queue.pop(0)
+            for candidate in (chunk["text"], chunk["summary"]):
+                tokens = context_packing.estimate_text_tokens(candidate)
+                if candidate and used + tokens <= budget:
+                    selected[position] = candidate
+                    used += tokens
+                    break
+        queues = [queue for queue in queues if queue]
+
+    sections = OrderedDict()
+    for position in sorted(selected):
+        sections.setdefault(chunks[position]["topic"], []).append(selected[position])
+    return "".join(f"\n--- TOPIC: {topic} ---\n" + "\n\n".join(texts) + "\n" for topic, texts in sections.items())
+
+def get_current_chapter_context(session_id: str, chapter_file: dict) -> Tuple[str, str]:
+    """
+    Context for ONE chapter and where it came from: "chunks" when built from its ingested
+    chunks, "pdf" when the chapter has not been ingested yet and the PDF is parsed instead
+    (cut to the same budget).
+    """
+    try:
+        chunks = load_chapter_chunks(session_id, chapter_file)
+        if chunks:
+            context = sample_chapter_context(chunks)
+            print(f"🧮 Assessment context for {chapter_file['filename']}: {len(chunks)} chunks, "
+                  f"~{context_packing.estimate_text_tokens(context)} tokens")
+            return context, "chunks"
+    except Exception as e:
+        print(f"⚠️ Could not read chunks for {chapter_file['filename']}, parsing the PDF instead: {e}")
+
     try:
-        from unstructured.partition.pdf import partition_pdf
-        elements = partition_pdf(filename=chapter_file["path"], strategy="fast")
-        return "\n".join([str(e) for e in elements])[:40000]
+        elements = get_document_elements(chapter_file["path"])
+        return "\n".join([str(e) for e in elements])[:ASSESSMENT_CONTEXT_TOKENS * llm_gateway.CHARS_PER_TOKEN], "pdf"
     except Exception as e:
         print(f"Error reading chapter {chapter_file['filename']}: {e}")
-        return ""
+        return "", "pdf"
 
 def get_assessment_prompt(level: int, context: str) -> str:
     if level == 1:
@@ -155,71 +254,175 @@ def get_assessment_prompt(level: int, context: str) -> str:
         """
     return ""
 
-def generate_assessment(session_id: str, level: int):
-    # 1. Check Cache
-    cache_file = os.path.join(ASSESSMENT_DIR, f"{session_id}_lvl{level}.json")
-    if os.path.exists(cache_file):
+def get_chapter_hash(chapter_file: dict) -> str:
+    """Content hash of a chapter PDF: a re-uploaded or edited chapter gets new assessments."""
+    return file_sha256_cached(chapter_file["path"])
+
+def get_assessment_cache_path(session_id: str, chapter_hash: str, level: int) -> str:
+    return os.path.join(ASSESSMENT_DIR, session_id, f"{chapter_hash[:16]}_lvl{level}.json")
+
+def load_cached_assessment(cache_file: str) -> Optional[dict]:
+    if not os.path.exists(cache_file):
+        return None
+    try:
         with open(cache_file, "r") as f:
-            return json.load(f)
+            result = json.load(f)
+        if result.get("version") == ASSESSMENT_VERSION:
+            return result
+    except Exception as e:
+        print(f"⚠️ Ignoring unreadable assessment cache {cache_file}: {e}")
+    return None
+
+def resolve_chapter(session_id: str, chapter_index: Optional[int] = None):
+    """Returns (chapter index, chapter file) or (None, error); defaults to the student's current chapter."""
+    if chapter_index is None:
+        progress = load_user_progress().get(session_id, {})
+        chapter_index = progress.get("current_chapter_index", 0)
 
-    # 2. Determine Current Chapter
-    progress = load_user_progress().get(session_id, {})
-    chapter_index = progress.get("current_chapter_index", 0)
-    
     files = get_sorted_files(session_id)
     if not files:
-        return {"error": "No documents found for this session."}
-        
+        return None, {"error": "No documents found for this session."}
+
     if chapter_index >= len(files):
-         return {"error": "All chapters completed! You are a master."}
-         
-    current_file = files[chapter_index]
-    
+        return None, {"error": "All chapters completed! You are a master."}
+
+    return chapter_index, files[chapter_index]
+
+def load_current_assessment(session_id: str, chapter_file: dict, cache_file: str) -> Optional[dict]:
+    """Stored assessment, unless it was built from the PDF and the chapter's chunks now exist."""
+    cached = load_cached_assessment(cache_file)
+    if cached is not None:
+        if cached.get("context_source") == "chunks" or not chapter_is_ingested(session_id, chapter_file):
+            return cached
+    return None
+
+def prepare_assessment(session_id: str, level: int, chapter_index: Optional[int] = None):
+    """
+    Blocking half of assessment generation: chapter selection, store lookup and prompt.
+    Returns (result, None) for a stored assessment or an error, else (None, request) where
+    request holds the messages to send and where to store the answer.
+    """
+    from langchain_core.messages import HumanMessage
+
+    # 1. Determine Chapter (the student's current one unless given)
+    chapter_index, current_file = resolve_chapter(session_id, chapter_index)
+    if chapter_index is None:
+        return current_file, None
+
+    # 2. Check Store
+    chapter_hash = get_chapter_hash(current_file)
+    cache_file = get_assessment_cache_path(session_id, chapter_hash, level)
+    cached = load_current_assessment(session_id, current_file, cache_file)
+    if cached is not None:
+        return cached, None
+
     # 3. Get Context for THIS Chapter ONLY
-    context = get_current_chapter_context(session_id, current_file)
+    context, context_source = get_current_chapter_context(session_id, current_file)
     if not context:
-        return {"error": f"Failed to load content for {current_file['filename']}"}
+        return {"error": f"Failed to load content for {current_file['filename']}"}, None
 
-    # 3. Generate
     prompt = get_assessment_prompt(level, context)
-    messages = [HumanMessage(content=prompt)]
+    return None, {
+        "messages": [HumanMessage(content=prompt)],
+        "cache_file": cache_file,
+        "session_id": session_id,
+        "chapter_file": current_file,
+        "chapter_name": current_file['filename'],
+        "chapter_index": chapter_index,
+        "chapter_hash": chapter_hash,
+        "context_source": context_source
+    }
+
+def finish_assessment(level: int, request: dict, content: str) -> dict:
+    """Parses the generated questions and stores the assessment."""
+    content = content.strip()
     
-    try:
-        response = llm.invoke(messages)
-        content = response.content.strip()
-        
-        # Clean Markdown
-        if content.startswith("```json"):
-            content = content[7:-3]
-        elif content.startswith("```"):
-            content = content[3:-3]
-            
-        assessment_data = json.loads(content)
+    # Clean Markdown
+    if content.startswith("```json"):
+        content = content[7:-3]
+    elif content.startswith("```"):
+        content = content[3:-3]
         
-        # Add metadata like timer
-        result = {
-            "level": level,
-            "timer_seconds": 600,
-            "questions": assessment_data,
-            "chapter_name": current_file['filename']
-        }
+    assessment_data = json.loads(content)
+    
+    # Add metadata like timer
+    result = {
+        "level": level,
+        "timer_seconds": 600,
+        "questions": assessment_data,
+        "chapter_name": request["chapter_name"],
+        "chapter_index": request["chapter_index"],
+        "chapter_hash": request["chapter_hash"],
+        "context_source": request["context_source"],
+        "version": ASSESSMENT_VERSION
+    }
+    
+    # Save to Store (atomic: concurrent readers never see a partial file)
+    atomic_write_json(request["cache_file"], result, indent=4)
         
-        # Save to Cache
-        with open(cache_file, "w") as f:
-            json.dump(result, f, indent=4)
-            
+    return result
+
+def generate_assessment(session_id: str, level: int, chapter_index: Optional[int] = None,
+                        priority: int = llm_gateway.PRIORITY_DEFAULT):
+    result, request = prepare_assessment(session_id, level, chapter_index)
+    if request is None:
         return result
-        
-    except Exception as e:
-        print(f"Assessment Generation Failed: {e}")
-        return {"error": "Failed to generate assessment."}
 
-def generate_remedial_plan(mistakes: List[Dict]) -> Dict:
+    # 3. Generate (unless a concurrent request or pre-generation stored it meanwhile)
+    with _assessment_locks.hold(request["cache_file"]):
+        stored = load_current_assessment(session_id, request["chapter_file"], request["cache_file"])
+        if stored is not None:
+            return stored
+        try:
+            response = llm_gateway.invoke(request["messages"], temperature=LLM_TEMPERATURE, priority=priority, output_tokens=4096)
+            return finish_assessment(level, request, response.content)
+        except Exception as e:
+            print(f"Assessment Generation Failed: {e}")
+            return {"error": "Failed to generate assessment."}
+
+async def agenerate_assessment(session_id: str, level: int, chapter_index: Optional[int] = None):
     """
-    Analyzes mistakes and generates a diagnostic remedial plan.
+    Async generate_assessment. Normally a pure read of the store (assessments are
+    pre-generated after ingestion); generates on demand only if that has not happened yet.
     """
-    if not mistakes:
-        return {}
+    result, request = await run_blocking(prepare_assessment, session_id, level, chapter_index)
+    if request is None:
+        return result
+    return await _assessment_flights.do(request["cache_file"], _agenerate_assessment, level, request)
+
+async def _agenerate_assessment(level: int, request: dict):
+    async with _assessment_locks.ahold(request["cache_file"]):
+        stored = await run_blocking(load_current_assessment, request["session_id"], request["chapter_file"],
+                                    request["cache_file"])
+        if stored is not None:
+            return stored
+        try:
+            response = await llm_gateway.ainvoke(request["messages"], temperature=LLM_TEMPERATURE, output_tokens=4096)
+            return await run_blocking(finish_assessment, level, request, response.content)
+        except Exception as e:
+            print(f"Assessment Generation Failed: {e}")
+            return {"error": "Failed to generate assessment."}
+
+def pregenerate_assessments(session_id: str, directory_path: Optional[str] = None):
+    """
+    Post-ingestion hook: makes sure every chapter has all levels stored. Chapters whose
+    content is unchanged are store hits, so only new or edited chapters call Gemini.
+    """
+    for chapter_index, chapter_file in enumerate(get_sorted_files(session_id)):
+        for level in ASSESSMENT_LEVELS:
+            result = generate_assessment(session_id, level, chapter_index, priority=llm_gateway.PRIORITY_BACKGROUND)
+            if "error" in result:
+                print(f"⚠️ Could not pre-generate level {level} for {chapter_file['filename']}: {result['error']}")
+    print(f"📝 Assessments ready for session {session_id}")
+
+REMEDIAL_FALLBACK = {
+    "diagnosis": "General Review Needed",
+    "explanation": "Please review the material again.",
+    "practice_question": None
+}
+
+def build_remedial_messages(mistakes: List[Dict]):
+    from langchain_core.messages import HumanMessage
 
     mistakes_text = json.dumps([{
         "question": m["question"], 
@@ -250,19 +453,36 @@ def generate_remedial_plan(mistakes: List[Dict]) -> Dict:
         }}
     }}
     """
+    return [HumanMessage(content=prompt)]
+
+def parse_remedial_plan(content: str) -> Dict:
+    content = content.strip()
+    if content.startswith("```json"): content = content[7:-3]
+    elif content.startswith("```"): content = content[3:-3]
+    return json.loads(content)
+
+def generate_remedial_plan(mistakes: List[Dict]) -> Dict:
+    """
+    Analyzes mistakes and generates a diagnostic remedial plan.
+    """
+    if not mistakes:
+        return {}
     try:
-        response = llm.invoke([HumanMessage(content=prompt)])
-        content = response.content.strip()
-        if content.startswith("```json"): content = content[7:-3]
-        elif content.startswith("```"): content = content[3:-3]
-        return json.loads(content)
+        response = llm_gateway.invoke(build_remedial_messages(mistakes), temperature=LLM_TEMPERATURE)
+        return parse_remedial_plan(response.content)
     except Exception as e:
         print(f"Remedial Plan Generation Failed: {e}")
-        return {
-            "diagnosis": "General Review Needed",
-            "explanation": "Please review the material again.",
-            "practice_question": None
-        }
+        return dict(REMEDIAL_FALLBACK)
+
+async def agenerate_remedial_plan(mistakes: List[Dict]) -> Dict:
+    if not mistakes:
+        return {}
+    try:
+        response = await llm_gateway.ainvoke(build_remedial_messages(mistakes), temperature=LLM_TEMPERATURE)
+        return parse_remedial_plan(response.content)
+    except Exception as e:
+        print(f"Remedial Plan Generation Failed: {e}")
+        return dict(REMEDIAL_FALLBACK)
 
 def spend_xp(session_id: str, amount: int) -> bool:
     """Deducts XP if sufficient balance exists. Returns True if successful."""
@@ -286,7 +506,22 @@ def save_user_progress(progress):
     with open(PROGRESS_FILE, "w") as f:
         json.dump(progress, f, indent=4)
 
-def submit_assessment_result(session_id: str, level: int, score: int, max_score: int, mistakes: List[Dict] = None):
+def is_passing_score(level: int, score: int) -> bool:
+    """Bloom's thresholds: L1 needs 8, L2 needs 7, L3 any credit."""
+    if level == 1:
+        return score >= 8
+    if level == 2:
+        return score >= 7
+    if level == 3:
+        return score > 0 # Strict passing for L3
+    return False
+
+def submit_assessment_result(session_id: str, level: int, score: int, max_score: int, mistakes: List[Dict] = None,
+                             remedial_plan: Optional[Dict] = None):
+    """
+    Records a result and updates XP/unlocks. A remedial plan generated ahead of time
+    (see asubmit_assessment_result) can be passed in; otherwise it is generated here on failure.
+    """
     progress = load_user_progress()
     
     if session_id not in progress:
@@ -314,7 +549,7 @@ def submit_assessment_result(session_id: str, level: int, score: int, max_score:
     
     # Bloom's Logic & Thresholds
     if level == 1:
-        if score >= 8: 
+        if is_passing_score(level, score):
             xp_gained = random.randint(50, 100)
             passed = True
             if user_data["unlocked_level"] < 2:
@@ -322,14 +557,14 @@ def submit_assessment_result(session_id: str, level: int, score: int, max_score:
                 
                 
     elif level == 2:
-        if score >= 7:
+        if is_passing_score(level, score):
             xp_gained = random.randint(100, 150)
             passed = True
             if user_data["unlocked_level"] < 3:
                 user_data["unlocked_level"] = 3
 
     elif level == 3:
-        if score > 0: # Strict passing for L3
+        if is_passing_score(level, score):
             xp_gained = random.randint(150, 200) + 500 # Bonus for Chapter Clear
             passed = True
             
@@ -349,7 +584,7 @@ def submit_assessment_result(session_id: str, level: int, score: int, max_score:
         # FAILED - Trigger Cooldown & Remedial Plan
         user_data["retry_available_at"] = time.time() + COOLDOWN_SECONDS
         if mistakes:
-            user_data["remedial_plan"] = generate_remedial_plan(mistakes)
+            user_data["remedial_plan"] = remedial_plan if remedial_plan is not None else generate_remedial_plan(mistakes)
     
     # Update History
     user_data["history"].append({
@@ -386,6 +621,14 @@ def submit_assessment_result(session_id: str, level: int, score: int, max_score:
         "score": score
     }
 
+async def asubmit_assessment_result(session_id: str, level: int, score: int, max_score: int,
+                                   mistakes: List[Dict] = None):
+    """Async submit: the remedial-plan Gemini call is awaited, progress I/O runs in the blocking pool."""
+    remedial_plan = None
+    if mistakes and not is_passing_score(level, score):
+        remedial_plan = await agenerate_remedial_plan(mistakes)
+    return await run_blocking(submit_assessment_result, session_id, level, score, max_score, mistakes, remedial_plan)
+
 def get_mistakes(session_id: str):
     progress = load_user_progress()
     if session_id == "all":
@@ -524,7 +767,56 @@ def get_teacher_analytics(session_id: str):
         "common_mistakes": common_mistakes
     }
 
-def get_all_assessments_for_teacher(session_id: str):
+def build_teacher_matrix(files: List[dict], entries: List[dict]) -> dict:
+    """Arranges per-(chapter, level) entries into the teacher preview structure."""
+    chapters = [
+        {"chapter_name": file_info['filename'], "chapter_index": idx, "quests": []}
+        for idx, file_info in enumerate(files)
+    ]
+    for entry in sorted(entries, key=lambda e: (e["chapter_index"], e["level"])):
+        assessment = entry["assessment"]
+        if "error" not in assessment:
+            chapters[entry["chapter_index"]]["quests"].append({
+                "level": entry["level"],
+                "questions": assessment.get("questions", []),
+                "timer_seconds": assessment.get("timer_seconds", 600)
+            })
+    return {"chapters": chapters}
+
+async def aiter_teacher_assessments(session_id: str, files: Optional[List[dict]] = None):
+    """
+    Yields one entry per (chapter, level) as soon as it is ready:
+    {"chapter_index", "chapter_name", "level", "cached", "assessment"}.
+    Stored entries come back immediately without an LLM call; missing ones are generated
+    with at most TEACHER_BULK_CONCURRENCY in flight, through the shared gateway.
+    Closing the generator cancels whatever has not started yet.
+    """
+    if files is None:
+        files = await run_blocking(get_sorted_files, session_id)
+    semaphore = asyncio.Semaphore(TEACHER_BULK_CONCURRENCY)
+
+    async def build(idx: int, level: int):
+        result, request = await run_blocking(prepare_assessment, session_id, level, idx)
+        if request is not None:
+            async with semaphore:
+                result = await _assessment_flights.do(request["cache_file"], _agenerate_assessment, level, request)
+        return {
+            "chapter_index": idx,
+            "chapter_name": files[idx]["filename"],
+            "level": level,
+            "cached": request is None and "error" not in result,
+            "assessment": result
+        }
+
+    tasks = [asyncio.ensure_future(build(idx, level)) for idx in range(len(files)) for level in ASSESSMENT_LEVELS]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def aget_all_assessments_for_teacher(session_id: str):
     """
     Returns all assessments organized by chapter and quest level for teacher preview.
     Structure:
@@ -541,30 +833,11 @@ def get_all_assessments_for_teacher(session_id: str):
             }
         ]
     }
+    Collected from aiter_teacher_assessments: stored assessments are read directly,
+    missing ones are generated concurrently.
     """
-    files = get_sorted_files(session_id)
+    files = await run_blocking(get_sorted_files, session_id)
     if not files:
         return {"chapters": []}
-    
-    chapters = []
-    
-    for idx, file_info in enumerate(files):
-        chapter_data = {
-            "chapter_name": file_info['filename'],
-            "chapter_index": idx,
-            "quests": []
-        }
-        
-        # Generate assessments for all 3 levels
-        for level in [1, 2, 3]:
-            assessment = generate_assessment(session_id, level)
-            if "error" not in assessment:
-                chapter_data["quests"].append({
-                    "level": level,
-                    "questions": assessment.get("questions", []),
-                    "timer_seconds": assessment.get("timer_seconds", 600)
-                })
-        
-        chapters.append(chapter_data)
-    
-    return {"chapters": chapters}
+    entries = [entry async for entry in aiter_teacher_assessments(session_id, files)]
+    return build_teacher_matrix(files, entries)
@@ -0,0 +1,87 @@
+import os
+import asyncio
+import functools
+import threading
+import contextlib
+import concurrent.futures
+
+# Bounded pool for blocking work (Chroma queries, file I/O, JSON parsing) called from
+# async request handlers, so it never runs on the uvicorn event loop.
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "16"))
+
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+async def run_blocking(fn, *args, **kwargs):
+    """Runs fn(*args, **kwargs) in the bounded blocking pool and awaits the result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical async calls: the first caller for a key runs the
+    computation, later callers await the same task. The key is forgotten once the task
+    finishes, so results are not cached here. A caller that is cancelled (e.g. the client
+    disconnected) does not cancel the shared task for the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._tasks = {}
+
+    async def do(self, key, coro_fn, *args, **kwargs):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_fn(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            print(f"🔗 {self.name}: joining in-flight request {key}")
+        return await asyncio.shield(task)
+
+class KeyedLocks:
+    """
+    One lock per key, shared by worker threads (hold) and coroutines (ahold), so a
+    background job and a request for the same result never generate it twice: whoever
+    comes second waits and then finds the stored result. Unused keys are forgotten.
+    """
+
+    def __init__(self, poll_seconds: float = 0.2):
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._locks = {}   # key -> [lock, holders + waiters]
+
+    def _checkout(self, key) -> threading.Lock:
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+            return entry[0]
+
+    def _checkin(self, key):
+        with self._lock:
+            entry = self._locks[key]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    @contextlib.contextmanager
+    def hold(self, key):
+        lock = self._checkout(key)
+        try:
+            with lock:
+                yield
+        finally:
+            self._checkin(key)
+
+    @contextlib.asynccontextmanager
+    async def ahold(self, key):
+        # Polled rather than acquired in a pool thread, so a cancelled waiter never leaves it held
+        lock = self._checkout(key)
+        try:
+            while not lock.acquire(blocking=False):
+                await asyncio.sleep(self.poll_seconds)
+            try:
+                yield
+            finally:
+                lock.release()
+        finally:
+            self._checkin(key)
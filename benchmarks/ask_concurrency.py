@@ -0,0 +1,121 @@
+"""
+Concurrency benchmark for /ask against a stubbed LLM and retrieval step.
+
+Fires N concurrent /ask requests at the in-process FastAPI app for several concurrency
+levels and reports latency percentiles. The "async" mode exercises the real handler
+(retrieval in the blocking pool, awaited Gemini call); "blocking" replays the old
+behaviour of calling the synchronous pipeline inside the async handler, for comparison.
+
+    python benchmarks/ask_concurrency.py
+    python benchmarks/ask_concurrency.py --levels 1 16 64 --llm-delay 0.8 --mode both
+
+Requires fastapi and httpx; no Gemini key, embeddings or Chroma data are needed.
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("FAST_BOOT", "1")
+
+import httpx
+import llm_gateway
+import retrieval_service
+import main as app_module
+
+class FakeResponse:
+    def __init__(self, content: str):
+        self.content = content
+        self.usage_metadata = {"total_tokens": 1500}
+
+class FakeChatModel:
+    """Stands in for ChatGoogleGenerativeAI with a fixed generation latency."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def invoke(self, messages):
+        time.sleep(self.delay)
+        return FakeResponse("stubbed answer")
+
+    async def ainvoke(self, messages):
+        await asyncio.sleep(self.delay)
+        return FakeResponse("stubbed answer")
+
+def install_stubs(llm_delay: float, retrieval_delay: float):
+    llm_gateway.gateway.get_client = lambda *args, **kwargs: FakeChatModel(llm_delay)
+    llm_gateway.gateway.max_concurrent = 10_000
+
+    def fake_embed(query):
+        # Random directions, so every question misses the semantic answer cache
+        return [random.gauss(0, 1) for _ in range(384)]
+
+    def fake_prepare(query, session_id, language="english", query_embedding=None):
+        time.sleep(retrieval_delay) # Chroma MMR search
+        return ["SYSTEM", f"USER QUESTION: {query}"], []
+
+    retrieval_service.embed_query = fake_embed
+    retrieval_service.prepare_doubt_request = fake_prepare
+
+def use_blocking_handler():
+    async def blocking_pipeline(query, session_id, language="english"):
+        return retrieval_service.get_doubt_assistant_response(query, session_id, language)
+    app_module.aget_doubt_assistant_response = blocking_pipeline
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+async def run_level(concurrency: int, rounds: int) -> dict:
+    transport = httpx.ASGITransport(app=app_module.app)
+    latencies = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        async def one(i):
+            start = time.perf_counter()
+            response = await client.post("/ask", params={"session_id": "bench", "query": f"question {i}"})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+        wall_start = time.perf_counter()
+        for _ in range(rounds):
+            await asyncio.gather(*(one(i) for i in range(concurrency)))
+        wall = time.perf_counter() - wall_start
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "p50": statistics.median(latencies),
+        "p99": percentile(latencies, 99),
+        "max": max(latencies),
+        "throughput": len(latencies) / wall,
+    }
+
+def report(mode: str, results):
+    print(f"\n== mode: {mode} ==")
+    print(f"{'concurrency':>12}{'requests':>10}{'p50 s':>10}{'p99 s':>10}{'max s':>10}{'req/s':>10}")
+    for r in results:
+        print(f"{r['concurrency']:>12}{r['requests']:>10}{r['p50']:>10.3f}{r['p99']:>10.3f}{r['max']:>10.3f}{r['throughput']:>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--rounds", type=int, default=3, help="bursts per concurrency level")
+    parser.add_argument("--llm-delay", type=float, default=0.5, help="stubbed Gemini latency (s)")
+    parser.add_argument("--retrieval-delay", type=float, default=0.02, help="stubbed retrieval latency (s)")
+    parser.add_argument("--mode", choices=["async", "blocking", "both"], default="both")
+    args = parser.parse_args()
+
+    install_stubs(args.llm_delay, args.retrieval_delay)
+    modes = ["async", "blocking"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        if mode == "blocking":
+            use_blocking_handler()
+        results = [asyncio.run(run_level(level, args.rounds)) for level in args.levels]
+        report(mode, results)
+
+if __name__ == "__main__":
+    main()
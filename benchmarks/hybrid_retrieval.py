@@ -0,0 +1,101 @@
+"""
+Offline recall/latency comparison of MMR-only vs hybrid (MMR + BM25, RRF) retrieval.
+
+Runs against an already ingested session (Chroma + uploads/<session>/lexical_index.json).
+Without a query file it builds known-item queries: for sampled chunks it takes the rarest
+terms of the chunk (numbers, acronyms, long technical words) as the question, and counts
+a hit when that chunk is retrieved in the top k.
+
+    python benchmarks/hybrid_retrieval.py --session <session_id>
+    python benchmarks/hybrid_retrieval.py --session <session_id> --queries queries.jsonl --k 8
+
+A query file holds one JSON object per line: {"query": "...", "chunk_id": "..."} or
+{"query": "...", "expect": "substring that a relevant chunk must contain"}.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lexical_index
+import retrieval_service
+import vector_store
+
+def known_item_queries(index: lexical_index.LexicalIndex, count: int, terms_per_query: int, seed: int):
+    rng = random.Random(seed)
+    chunk_ids = rng.sample(sorted(index.docs), min(count, len(index.docs)))
+    queries = []
+    for chunk_id in chunk_ids:
+        candidates = [t for t in index.docs[chunk_id] if any(c.isdigit() for c in t) or len(t) >= 6]
+        if not candidates:
+            continue
+        rare = sorted(candidates, key=lambda t: len(index.postings.get(t, ())))[:terms_per_query]
+        queries.append({"query": " ".join(rare), "chunk_id": chunk_id})
+    return queries
+
+def is_hit(case: dict, docs) -> bool:
+    if "chunk_id" in case:
+        return any(doc.id == case["chunk_id"] for doc in docs)
+    return any(case["expect"].lower() in doc.page_content.lower() for doc in docs)
+
+def run(name: str, search_fn, cases, embeddings):
+    if not cases:
+        return {"mode": name, "queries": 0, "recall": 0.0, "p50_ms": 0.0, "p95_ms": 0.0}
+    latencies, hits = [], 0
+    for case in cases:
+        start = time.perf_counter()
+        docs = search_fn(case["query"], embeddings[case["query"]])
+        latencies.append(time.perf_counter() - start)
+        hits += is_hit(case, docs)
+    latencies.sort()
+    return {
+        "mode": name,
+        "queries": len(cases),
+        "recall": hits / len(cases),
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--session", required=True)
+    parser.add_argument("--queries", help="JSONL query file (default: generated known-item queries)")
+    parser.add_argument("--count", type=int, default=100, help="generated queries")
+    parser.add_argument("--terms", type=int, default=3, help="rare terms per generated query")
+    parser.add_argument("--k", type=int, default=retrieval_service.RETRIEVAL_K)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    index = lexical_index.load_index(os.path.join(lexical_index.UPLOAD_ROOT, args.session))
+    if not len(index):
+        sys.exit(f"No lexical index for session {args.session}; ingest it first.")
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            cases = [json.loads(line) for line in f if line.strip()]
+    else:
+        cases = known_item_queries(index, args.count, args.terms, args.seed)
+
+    db = vector_store.get_session_store(args.session)
+    # Embedding cost is identical for both modes, so it is paid once up front
+    embeddings = {case["query"]: retrieval_service.embed_query(case["query"]) for case in cases}
+
+    results = [
+        run("mmr", lambda q, e: retrieval_service.dense_search(db, e, args.session, args.k), cases, embeddings),
+        run("hybrid", lambda q, e: retrieval_service.hybrid_search(db, q, e, args.session, args.k), cases, embeddings),
+        # Lexical side alone; ids only, so it is scored on chunk_id cases
+        run("bm25-only", lambda q, e: [SimpleNamespace(id=cid) for cid, _ in index.search(q, args.k)],
+            [c for c in cases if "chunk_id" in c], embeddings),
+    ]
+    print(f"\nSession {args.session}: {len(index)} chunks, {len(cases)} queries, k={args.k}")
+    print(f"{'mode':>10}{'queries':>9}{'recall':>9}{'p50 ms':>9}{'p95 ms':>9}")
+    for r in results:
+        print(f"{r['mode']:>10}{r['queries']:>9}{r['recall']:>9.2f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Cold-start benchmark: import time and resident memory per module.
+
+Each module is imported in a fresh interpreter, so the numbers include everything the
+module pulls in transitively. Run from the repository root:
+
+    python benchmarks/import_time.py                  # default module list
+    python benchmarks/import_time.py main --repeat 5  # one module, median of 5 runs
+    python benchmarks/import_time.py --json --budget 1.5
+
+With --budget, exits non-zero if importing `main` takes longer than that many seconds,
+so CI can catch startup regressions.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES = [
+    # Third-party heavyweights, for reference
+    "fastapi",
+    "langchain_core.messages",
+    "langchain_google_genai",
+    "langchain_chroma",
+    "langchain_huggingface",
+    "unstructured.partition.pdf",
+    # Our modules
+    "llm_gateway",
+    "vector_store",
+    "retrieval_service",
+    "flashcard_service",
+    "assessment_service",
+    "ingestion_pipeline",
+    "main",
+]
+
+PROBE = """
+import json, resource, sys, time, importlib
+def rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+before = rss_mb()
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "rss_mb": rss_mb(), "rss_delta_mb": rss_mb() - before}))
+"""
+
+def measure(module: str) -> dict:
+    env = {**os.environ, "FAST_BOOT": "1"}
+    proc = subprocess.run([sys.executable, "-c", PROBE, module], cwd=ROOT, env=env,
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        error = (proc.stderr.strip().splitlines() or ["import failed"])[-1]
+        return {"error": error}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per module (median is reported)")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    parser.add_argument("--budget", type=float, help="max seconds allowed for importing main")
+    args = parser.parse_args()
+
+    results = {}
+    for module in args.modules:
+        runs = [measure(module) for _ in range(args.repeat)]
+        ok = [r for r in runs if "error" not in r]
+        if not ok:
+            results[module] = runs[0]
+            continue
+        results[module] = {
+            "seconds": statistics.median(r["seconds"] for r in ok),
+            "rss_mb": statistics.median(r["rss_mb"] for r in ok),
+            "rss_delta_mb": statistics.median(r["rss_delta_mb"] for r in ok),
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'module':<32}{'import s':>10}{'RSS MB':>10}{'+RSS MB':>10}")
+        for module, r in results.items():
+            if "error" in r:
+                print(f"{module:<32}  ERROR: {r['error']}")
+            else:
+                print(f"{module:<32}{r['seconds']:>10.3f}{r['rss_mb']:>10.1f}{r['rss_delta_mb']:>10.1f}")
+
+    if args.budget is not None:
+        main_result = results.get("main") or measure("main")
+        if "error" in main_result or main_result["seconds"] > args.budget:
+            print(f"❌ Cold-start budget exceeded: main -> {main_result}")
+            sys.exit(1)
+        print(f"✅ main imports in {main_result['seconds']:.3f}s (budget {args.budget}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import os
+import json
+import base64
+import time
+import hashlib
+import tempfile
+from typing import Iterable, List, Optional, Set, Tuple
+
+# Content-addressed store for chunk images and tables, kept out of Chroma metadata.
+# A reference looks like "image:<sha256>" or "table:<sha256>"; identical assets are stored once.
+BLOB_ROOT = os.path.join("data", "blobs")
+# Unreferenced blobs younger than this survive a sweep: an ingestion may have stored them
+# and not yet upserted the chunks that point at them
+BLOB_SWEEP_MIN_AGE_SECONDS = int(os.getenv("BLOB_SWEEP_MIN_AGE_SECONDS", "3600"))
+
+def _blob_path(kind: str, digest: str) -> str:
+    return os.path.join(BLOB_ROOT, kind, digest[:2], digest)
+
+def _put(kind: str, data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()
+    path = _blob_path(kind, digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp_")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return f"{kind}:{digest}"
+
+def _get(ref: str) -> Optional[bytes]:
+    kind, _, digest = ref.partition(":")
+    try:
+        with open(_blob_path(kind, digest), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        print(f"⚠️ Missing blob: {ref}")
+        return None
+
+def put_image(image_base64: str) -> str:
+    """Stores a base64 image (decoded, so it takes 25% less space) and returns its reference."""
+    return _put("image", base64.b64decode(image_base64))
+
+def put_table(table_html: str) -> str:
+    return _put("table", table_html.encode("utf-8"))
+
+def get_image_base64(ref: str) -> Optional[str]:
+    data = _get(ref)
+    return base64.b64encode(data).decode("ascii") if data is not None else None
+
+def get_table_html(ref: str) -> Optional[str]:
+    data = _get(ref)
+    return data.decode("utf-8") if data is not None else None
+
+def make_original_content(raw_text: str, tables_html: List[str], images_base64: List[str]) -> str:
+    """Builds the 'original_content' metadata value, with assets replaced by blob references."""
+    return json.dumps({
+        "raw_text": raw_text,
+        "table_refs": [put_table(t) for t in tables_html],
+        "image_refs": [put_image(i) for i in images_base64]
+    })
+
+def chunk_refs(metadata: Optional[dict]) -> List[str]:
+    """Blob references held by one chunk's metadata."""
+    try:
+        original = json.loads((metadata or {}).get("original_content") or "{}")
+    except json.JSONDecodeError:
+        return []
+    return list(original.get("table_refs", [])) + list(original.get("image_refs", []))
+
+def sweep(live_refs: Iterable[str], min_age_seconds: int = BLOB_SWEEP_MIN_AGE_SECONDS) -> Tuple[int, int]:
+    """
+    Deletes blobs that no live chunk references (blobs are shared by content, so this is the
+    only safe way to free them). Returns (blobs removed, bytes freed).
+    """
+    live: Set[str] = set(live_refs)
+    removed, freed = 0, 0
+    cutoff = time.time() - min_age_seconds
+    for kind in ("image", "table"):
+        for dirpath, _, filenames in os.walk(os.path.join(BLOB_ROOT, kind)):
+            for digest in filenames:
+                path = os.path.join(dirpath, digest)
+                if digest.startswith(".tmp_") or f"{kind}:{digest}" in live:
+                    continue
+                try:
+                    stat = os.stat(path)
+                    if stat.st_mtime > cutoff:
+                        continue
+                    os.remove(path)
+                except OSError:
+                    continue
+                removed += 1
+                freed += stat.st_size
+    if removed:
+        print(f"🧹 Removed {removed} unreferenced blobs ({freed / 1e6:.1f} MB)")
+    return removed, freed
+
+def load_chunk_assets(metadata: dict) -> dict:
+    """
+    Resolves a chunk's 'original_content' into raw text, table HTML and base64 images.
+    Chunks ingested before the blob store carry the assets inline and are returned as-is.
+    """
+    try:
+        original = json.loads(metadata.get("original_content") or "{}")
+    except json.JSONDecodeError:
+        original = {}
+
+    tables = original.get("tables_html")
+    if tables is None:
+        tables = [t for t in map(get_table_html, original.get("table_refs", [])) if t is not None]
+    images = original.get("images_base64")
+    if images is None:
+        images = [i for i in map(get_image_base64, original.get("image_refs", [])) if i is not None]
+
+    return {
+        "raw_text": original.get("raw_text", ""),
+        "tables_html": tables,
+        "images_base64": images
+    }
@@ -0,0 +1,124 @@
+import os
+import shutil
+from typing import Dict, Set
+
+import answer_cache
+import blob_store
+import parse_cache
+import ingestion_jobs
+from assessment_service import ASSESSMENT_DIR
+import session_vector_index
+import vector_store
+from file_utils import file_sha256_cached
+from ingestion_manifest import MANIFEST_NAME, load_manifest
+from lexical_index import LEXICAL_INDEX_NAME
+
+# --- CONFIG ---
+# Delete / archive / restore a whole classroom: its Chroma collection plus the index files
+# that describe what is stored in it (ingestion manifest, BM25 index). Uploaded PDFs stay in
+# place on archive, so a restored classroom is immediately usable again.
+UPLOAD_ROOT = "uploads"
+INDEX_FILES = (MANIFEST_NAME, LEXICAL_INDEX_NAME)
+
+def _check_session_id(session_id: str):
+    if not session_id or session_id in (".", "..") or os.path.basename(session_id) != session_id:
+        raise ValueError(f"Invalid session id: {session_id!r}")
+
+def _ensure_idle(session_id: str):
+    job = ingestion_jobs.get_status(session_id)
+    if job and job["state"] in ("queued", "running"):
+        raise RuntimeError(f"Session {session_id} is being ingested; try again when the job finishes")
+    if ingestion_jobs.hooks_pending(session_id):
+        # Pre-generation would recreate caches (and the collection) after they are removed
+        raise RuntimeError(f"Session {session_id} is pre-generating flashcards and assessments; try again shortly")
+
+def _forget_cached_state(session_id: str):
+    answer_cache.invalidate_session(session_id)
+    session_vector_index.invalidate(session_id)
+
+def _manifest_hashes(directory_path: str) -> Set[str]:
+    manifest = load_manifest(directory_path)
+    return set(manifest["files"]) if manifest else set()
+
+def _session_file_hashes(session_id: str) -> Set[str]:
+    """Content hashes of a classroom: its PDFs on disk plus its live and archived manifests."""
+    session_dir = os.path.join(UPLOAD_ROOT, session_id)
+    hashes = _manifest_hashes(session_dir) | _manifest_hashes(os.path.join(vector_store.ARCHIVE_ROOT, session_id))
+    if os.path.isdir(session_dir):
+        for name in os.listdir(session_dir):
+            if name.lower().endswith(".pdf"):
+                hashes.add(file_sha256_cached(os.path.join(session_dir, name)))
+    return hashes
+
+def release_shared_storage(file_hashes: Set[str]) -> Dict:
+    """
+    Frees what a deleted classroom left in the content-addressed stores: parse-cache entries
+    of its files that no other classroom (live or archived) uses, and blobs that no remaining
+    chunk references.
+    """
+    in_use = set()
+    for root in (UPLOAD_ROOT, vector_store.ARCHIVE_ROOT):
+        if os.path.isdir(root):
+            for session_id in os.listdir(root):
+                in_use |= _manifest_hashes(os.path.join(root, session_id))
+    parses = sum(parse_cache.remove_entries(file_hash) for file_hash in file_hashes - in_use)
+    blobs, freed = blob_store.sweep(ref for metadata in vector_store.iter_metadatas()
+                                    for ref in blob_store.chunk_refs(metadata))
+    return {"parse_cache_entries_removed": parses, "blobs_removed": blobs, "blob_bytes_freed": freed}
+
+def delete_classroom(session_id: str) -> Dict:
+    """
+    Removes a classroom's vectors, uploads, stored assessments and archive, then the parse-cache
+    entries and blobs nothing else uses. Space is freed immediately.
+    """
+    _check_session_id(session_id)
+    _ensure_idle(session_id)
+    file_hashes = _session_file_hashes(session_id)
+    chunks = vector_store.drop_session(session_id)
+    session_dir = os.path.join(UPLOAD_ROOT, session_id)
+    removed_dir = os.path.isdir(session_dir)
+    if removed_dir:
+        shutil.rmtree(session_dir)
+    shutil.rmtree(os.path.join(vector_store.ARCHIVE_ROOT, session_id), ignore_errors=True)
+    shutil.rmtree(os.path.join(ASSESSMENT_DIR, session_id), ignore_errors=True)
+    _forget_cached_state(session_id)
+    try:
+        released = release_shared_storage(file_hashes)
+    except Exception as e:
+        # The classroom itself is gone; leftovers are reclaimed by the next delete
+        print(f"⚠️ Could not release shared storage after deleting {session_id}: {e}")
+        released = {}
+    print(f"🗑️ Deleted classroom {session_id} ({chunks} chunks)")
+    return {"session_id": session_id, "chunks_deleted": chunks, "uploads_removed": removed_dir, **released}
+
+def archive_classroom(session_id: str) -> Dict:
+    """Moves a classroom's vectors and index files to the archive and drops its collection."""
+    _check_session_id(session_id)
+    _ensure_idle(session_id)
+    session_dir = os.path.join(UPLOAD_ROOT, session_id)
+    if not os.path.isdir(session_dir):
+        raise FileNotFoundError(f"Classroom {session_id} not found")
+    chunks = vector_store.archive_session(session_id)
+    archive_dir = os.path.dirname(vector_store.archive_path(session_id))
+    for name in INDEX_FILES:
+        if os.path.exists(os.path.join(session_dir, name)):
+            os.replace(os.path.join(session_dir, name), os.path.join(archive_dir, name))
+    _forget_cached_state(session_id)
+    return {"session_id": session_id, "chunks_archived": chunks, "archive": archive_dir}
+
+def restore_classroom(session_id: str) -> Dict:
+    """Brings an archived classroom back into Chroma together with its index files."""
+    _check_session_id(session_id)
+    _ensure_idle(session_id)
+    if not os.path.exists(vector_store.archive_path(session_id)):
+        raise FileNotFoundError(f"No archive for classroom {session_id}")
+    archive_dir = os.path.dirname(vector_store.archive_path(session_id))
+    session_dir = os.path.join(UPLOAD_ROOT, session_id)
+    os.makedirs(session_dir, exist_ok=True)
+    chunks = vector_store.restore_session(session_id)
+    for name in INDEX_FILES:
+        if os.path.exists(os.path.join(archive_dir, name)):
+            os.replace(os.path.join(archive_dir, name), os.path.join(session_dir, name))
+    shutil.rmtree(archive_dir, ignore_errors=True)
+    _forget_cached_state(session_id)
+    return {"session_id": session_id, "chunks_restored": chunks}
@@ -0,0 +1,141 @@
+import os
+import re
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from llm_gateway import CHARS_PER_TOKEN
+
+# --- CONFIG ---
+# Retrieved chunks are packed into a token budget before they reach the prompt. Each stored
+# chunk carries TOPIC + SUMMARY + full ORIGINAL TEXT, so packing picks one representation per
+# chunk, drops sentences already included by a higher-ranked chunk and groups by parent_topic.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+MIN_SNIPPET_TOKENS = 60   # A truncated chunk shorter than this is not worth including
+TRUNCATED_KEEP_SHARE = 0.5   # Truncated preferred text filling this share of the remaining budget is kept
+
+# Questions about exact facts need the original wording; conceptual ones are served by summaries
+DETAIL_PATTERN = re.compile(
+    r"\d|\"|\b(exact|exactly|value|values|number|formula|equation|define|definition|quote|table|"
+    r"score|result|results|percent|accuracy|list|steps|code|syntax|according)\b",
+    re.IGNORECASE,
+)
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+
+def estimate_text_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN
+
+def classify_query(query: str) -> str:
+    """'detail' prefers the raw text of each chunk, 'overview' prefers its summary."""
+    return "detail" if DETAIL_PATTERN.search(query) else "overview"
+
+def split_chunk(page_content: str) -> Dict[str, str]:
+    """Splits a stored chunk ("TOPIC: .. SUMMARY: .. ORIGINAL TEXT: ..") into its parts."""
+    topic, summary, raw = "", "", page_content
+    if page_content.startswith("TOPIC: "):
+        head, _, rest = page_content.partition("\n")
+        topic = head[len("TOPIC: "):].strip()
+        raw = rest
+        if rest.startswith("SUMMARY: ") and "\n\nORIGINAL TEXT: " in rest:
+            summary, _, raw = rest[len("SUMMARY: "):].partition("\n\nORIGINAL TEXT: ")
+    return {"topic": topic, "summary": summary.strip(), "raw": raw.strip()}
+
+def _normalize_sentence(sentence: str) -> str:
+    return " ".join(re.findall(r"\w+", sentence.lower()))
+
+def _fresh_sentences(text: str, seen: set) -> List[str]:
+    """
+    Sentences of `text` not already packed from another chunk. Short fragments are kept,
+    unless the whole text (e.g. a one-line summary) was already packed.
+    """
+    if _normalize_sentence(text) in seen:
+        return []
+    fresh = []
+    local = set()
+    for sentence in SENTENCE_SPLIT.split(text):
+        sentence = sentence.strip()
+        key = _normalize_sentence(sentence)
+        if not sentence or key in seen or key in local:
+            continue
+        if len(key) >= 20:
+            local.add(key)
+        fresh.append(sentence)
+    return fresh
+
+def _mark_seen(text: str, seen: set):
+    seen.add(_normalize_sentence(text))
+    for sentence in SENTENCE_SPLIT.split(text):
+        key = _normalize_sentence(sentence)
+        if len(key) >= 20:
+            seen.add(key)
+
+def _fit(sentences: List[str], budget: int) -> str:
+    """Longest sentence prefix that fits the token budget."""
+    kept, used = [], 0
+    for sentence in sentences:
+        cost = estimate_text_tokens(sentence) + 1
+        if used + cost > budget:
+            break
+        kept.append(sentence)
+        used += cost
+    return " ".join(kept)
+
+def pack_context(query: str, docs, budget: int = CONTEXT_TOKEN_BUDGET) -> Tuple[str, Dict]:
+    """
+    Packs retrieved documents (best first) into at most `budget` estimated tokens.
+    Returns the context text, grouped by parent topic, and packing stats for logging.
+    """
+    mode = classify_query(query)
+    seen = set()
+    groups = OrderedDict()   # parent_topic -> list of (label, text), in order of best rank
+    used = 0
+    tokens_before = 0
+    chunks_used = 0
+    for rank, doc in enumerate(docs, start=1):
+        tokens_before += estimate_text_tokens(doc.page_content)
+        parts = split_chunk(doc.page_content)
+        topic = doc.metadata.get("parent_topic") or parts["topic"] or "General"
+        preferred, fallback = (parts["raw"], parts["summary"]) if mode == "detail" else (parts["summary"], parts["raw"])
+        remaining = budget - used
+        if remaining < MIN_SNIPPET_TOKENS:
+            continue
+
+        text = ""
+        for candidate in (preferred, fallback):
+            if not candidate:
+                continue
+            sentences = _fresh_sentences(candidate, seen)
+            full = " ".join(sentences)
+            if not full:
+                continue   # Everything in it was already packed from a better-ranked chunk
+            if estimate_text_tokens(full) <= remaining:
+                text = full
+                break
+            # Too long: keep the truncated preferred text if it fills a fair share of the budget,
+            # otherwise let the other representation replace it if that fits whole
+            if not text:
+                text = _fit(sentences, remaining)
+                if estimate_text_tokens(text) >= remaining * TRUNCATED_KEEP_SHARE:
+                    break
+        if not text:
+            continue
+        _mark_seen(text, seen)
+
+        label = f"Chunk {rank} | {doc.metadata.get('source', 'unknown source')}"
+        groups.setdefault(topic, []).append((label, text))
+        used += estimate_text_tokens(text)
+        chunks_used += 1
+
+    sections = []
+    for topic, items in groups.items():
+        body = "\n\n".join(f"[{label}]\n{text}" for label, text in items)
+        sections.append(f"\n--- TOPIC: {topic} ---\n{body}\n")
+    stats = {
+        "mode": mode,
+        "chunks_retrieved": len(docs),
+        "chunks_used": chunks_used,
+        "topics": len(groups),
+        "tokens_before": tokens_before,
+        "tokens_after": used,
+        "budget": budget,
+    }
+    return "".join(sections), stats
@@ -0,0 +1,36 @@
+import os
+import json
+import hashlib
+import tempfile
+
+def file_sha256(file_path: str, block_size: int = 1 << 20) -> str:
+    """Returns the hex SHA-256 of a file's contents, read in blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+_hash_memo = {}
+
+def file_sha256_cached(file_path: str) -> str:
+    """file_sha256 memoized on (path, size, mtime) to avoid re-reading unchanged files."""
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _hash_memo:
+        _hash_memo[memo_key] = file_sha256(file_path)
+    return _hash_memo[memo_key]
+
+def atomic_write_json(path: str, data, **dump_kwargs):
+    """Writes JSON to a temp file in the same directory and renames it over `path`."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=".json")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, **dump_kwargs)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -1,10 +1,10 @@
 import os
 import json
-from typing import List, Dict
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_core.messages import HumanMessage, SystemMessage
+import asyncio
+import hashlib
+import concurrent.futures
+from collections import OrderedDict
+from typing import List, Dict, Optional
 from tenacity import (
     retry,
     stop_after_attempt,
@@ -12,13 +12,30 @@ from tenacity import (
     retry_if_exception_type
 )
 from dotenv import load_dotenv
+import context_packing
+import llm_gateway
+import vector_store
+from async_utils import run_blocking, SingleFlight, KeyedLocks
+from file_utils import atomic_write_json
+from ingestion_manifest import load_manifest, content_fingerprint
 
 load_dotenv(override=True)
 
 # --- CONFIG ---
-CHROMA_PATH = "./chroma_db"
-LOCAL_EMBEDDINGS = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.3)
+LLM_TEMPERATURE = 0.3
+# Flashcards are generated per parent_topic unit (topics of one file packed up to this many
+# estimated tokens), as parallel calls through the gateway, and cached per unit
+FLASHCARD_UNIT_TOKENS = int(os.getenv("FLASHCARD_UNIT_TOKENS", "6000"))
+FLASHCARD_WORKERS = int(os.getenv("FLASHCARD_WORKERS", "4"))
+FLASHCARD_PROMPT_VERSION = 1   # Bump when the prompt changes to invalidate cached unit cards
+FLASHCARD_MERGE_VERSION = 2   # Bump when finish_flashcards changes: merged decks rebuild from the unit cache
+BASE_LANGUAGE = "english"
+# Built in the background after each ingestion: English first, then these by translating it
+FLASHCARD_PREWARM_LANGUAGES = [l.strip().lower() for l in os.getenv("FLASHCARD_PREWARM_LANGUAGES", "hindi,telugu,hinglish").split(",") if l.strip()]
+
+# A whole class opening flashcards at once waits on a single generation per language
+_flashcard_flights = SingleFlight("flashcards")
+_flashcard_locks = KeyedLocks()
 
 @retry(
     stop=stop_after_attempt(5),
@@ -26,13 +43,36 @@ llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.3)
     retry=retry_if_exception_type(Exception),
     before_sleep=lambda retry_state: print(f"⚠️ API Limit hit (Flashcards). Retrying in {retry_state.next_action.sleep} seconds...")
 )
-def generate_ai_response(messages):
+def generate_ai_response(messages, priority: int = llm_gateway.PRIORITY_DEFAULT):
     try:
-        return llm.invoke(messages)
+        return llm_gateway.invoke(messages, temperature=LLM_TEMPERATURE, priority=priority, output_tokens=4096)
     except Exception as e:
         print(f"DEBUG: API call failed with error: {str(e)}")
         raise e
 
+@retry(
+    stop=stop_after_attempt(5),
+    wait=wait_exponential(multiplier=1, min=2, max=10),
+    retry=retry_if_exception_type(Exception),
+    before_sleep=lambda retry_state: print(f"⚠️ API Limit hit (Flashcards). Retrying in {retry_state.next_action.sleep} seconds...")
+)
+async def agenerate_ai_response(messages, priority: int = llm_gateway.PRIORITY_DEFAULT):
+    try:
+        return await llm_gateway.ainvoke(messages, temperature=LLM_TEMPERATURE, priority=priority, output_tokens=4096)
+    except Exception as e:
+        print(f"DEBUG: API call failed with error: {str(e)}")
+        raise e
+
+SCRIPT_RULES = """6. **STRICT LANGUAGE & SCRIPT RULE**:
+   - If **Hindi** is selected: You MUST use **Devanagari script (हिन्दी)** for all explanations. Do NOT use Roman script (English alphabets) for Hindi sentences.
+   - If **Telugu** is selected: You MUST use **Telugu script (తెలుగు)** for all explanations. Do NOT use Roman script (English alphabets) for Telugu sentences. This is CRITICAL.
+   - If **Hinglish** is selected: Use **English alphabets (Roman script)** for the entire summary.
+   - If **English** is selected: Use English.
+   - **Technical Terms**: Keep all technical terms, technical definitions, and proper nouns in **English** (Roman script) even when writing in Hindi or Telugu script.
+     - *Example (Hindi)*: "Neural Network एक कम्प्यूटर सिस्टम है..."
+     - *Example (Telugu)*: "Neural Network అనేది ఒక కంప్యూటర్ సిస్టమ్..."
+"""
+
 FLASHCARD_SYSTEM_PROMPT = """
 You are an expert educational content creator. Your goal is to extract the main topics from a provided text and create concise, high-impact revision summaries for each topic.
 
@@ -44,86 +84,292 @@ Rules for your response:
    - "summary": The concise revision notes for that topic.
 4. **Style**: Use bullet points and bold text for key terms within the summary.
 5. **JSON ONLY**: Your entire response MUST be a valid JSON object. Do not include any markdown formatting like ```json ... ``` tags.
-6. **STRICT LANGUAGE & SCRIPT RULE**:
-   - If **Hindi** is selected: You MUST use **Devanagari script (हिन्दी)** for all explanations. Do NOT use Roman script (English alphabets) for Hindi sentences.
-   - If **Telugu** is selected: You MUST use **Telugu script (తెలుగు)** for all explanations. Do NOT use Roman script (English alphabets) for Telugu sentences. This is CRITICAL.
-   - If **Hinglish** is selected: Use **English alphabets (Roman script)** for the entire summary.
-   - If **English** is selected: Use English.
-   - **Technical Terms**: Keep all technical terms, technical definitions, and proper nouns in **English** (Roman script) even when writing in Hindi or Telugu script.
-     - *Example (Hindi)*: "Neural Network एक कम्प्यूटर सिस्टम है..."
-     - *Example (Telugu)*: "Neural Network అనేది ఒక కంప్యూటర్ సిస్టమ్..."
-"""
+""" + SCRIPT_RULES
 
-def generate_flashcards(session_id: str, language: str = "english"):
-    """
-    Generates topic-wise revision summaries from the ingested materials of a session.
-    """
+FLASHCARD_TRANSLATION_PROMPT = """
+You are an expert educational translator. You receive revision flashcards as a JSON object with a list called "flashcards" (each item has "topic" and "summary") and translate them.
+
+Rules for your response:
+1. **Faithful Translation**: Translate every "summary" completely. Do not add, drop, merge or reorder flashcards.
+2. **Topics**: Keep every "topic" exactly as given (In English).
+3. **Formatting**: Keep the bullet points and bold text of each summary.
+4. **Length**: Keep each summary about as concise as the original.
+5. **JSON ONLY**: Return the same JSON structure. Do not include any markdown formatting like ```json ... ``` tags.
+""" + SCRIPT_RULES
+
+def get_flashcard_cache_path(session_id: str, language: str) -> str:
     cache_name = f"flashcards_v9_{language.lower()}.json"
-    flashcard_cache_path = os.path.join("uploads", session_id, cache_name)
-    
-    # Check if already generated for this language
+    return os.path.join("uploads", session_id, cache_name)
+
+def session_content_fingerprint(session_id: str) -> Optional[str]:
+    """Fingerprint of the session's ingested files; the merged flashcard cache is only valid for it."""
+    fingerprint = content_fingerprint(load_manifest(os.path.join("uploads", session_id)))
+    return f"v{FLASHCARD_PROMPT_VERSION}.{FLASHCARD_MERGE_VERSION}:{fingerprint}" if fingerprint else None
+
+def load_cached_flashcards(session_id: str, language: str):
+    """Returns the cached flashcards for this language, or None if not generated yet or stale."""
+    flashcard_cache_path = get_flashcard_cache_path(session_id, language)
     if os.path.exists(flashcard_cache_path):
         try:
             with open(flashcard_cache_path, "r", encoding="utf-8") as f:
-                return json.load(f)["flashcards"]
+                data = json.load(f)
+            if data.get("fingerprint") == session_content_fingerprint(session_id):
+                return data["flashcards"]
+            print(f"♻️ {language} flashcards of session {session_id} are stale (new or changed uploads)")
         except Exception as e:
             print(f"⚠️ Error reading flashcard cache: {e}")
+    return None
 
-    # 1. Connect to DB
-    db = Chroma(
-        persist_directory=CHROMA_PATH,
-        embedding_function=LOCAL_EMBEDDINGS,
-        collection_name="hackathon_collection"
-    )
+def get_topic_cache_path(session_id: str, language: str) -> str:
+    return os.path.join("uploads", session_id, f"flashcard_topics_{language.lower()}.json")
 
-    # 2. Retrieve all unique chunks for this session
-    print(f"🔍 Retrieving material for {language} flashcards in session: {session_id}")
-    results = db.get(
-        where={"session_id": session_id},
-        include=["documents"]
-    )
-    
-    docs = results.get("documents", [])
-    if not docs:
-        print(f"⚠️ No documents found for session {session_id}")
+def load_topic_cache(session_id: str, language: str) -> Dict[str, list]:
+    """Cards per unit key (see plan_flashcard_units); empty if nothing was generated yet."""
+    path = get_topic_cache_path(session_id, language)
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == FLASHCARD_PROMPT_VERSION:
+                return data["units"]
+        except Exception as e:
+            print(f"⚠️ Error reading flashcard topic cache: {e}")
+    return {}
+
+def _chunk_order(chunk_id: str, source: str):
+    # Chunk ids are "<session>:<file hash>:<index>"; keep document order within each file
+    index = chunk_id.rsplit(":", 1)[-1]
+    return (source or "", int(index) if index.isdigit() else 0)
+
+def load_session_chunks(session_id: str) -> List[dict]:
+    """All chunks of a session in document order, with their parent_topic."""
+    db = vector_store.get_session_store(session_id, create=False)
+    if db is None:
         return []
+    print(f"🔍 Retrieving material for flashcards in session: {session_id}")
+    results = db.get(where=vector_store.session_filter(session_id), include=["documents", "metadatas"])
+    chunks = []
+    for chunk_id, text, metadata in zip(results["ids"], results["documents"], results["metadatas"]):
+        parts = context_packing.split_chunk(text or "")
+        chunks.append({
+            "id": chunk_id,
+            "source": metadata.get("source"),
+            "topic": metadata.get("parent_topic") or parts["topic"] or "General",
+            "text": parts["raw"] or text or "",
+        })
+    chunks.sort(key=lambda c: _chunk_order(c["id"], c["source"]))
+    return chunks
+
+def plan_flashcard_units(chunks: List[dict], max_tokens: int = FLASHCARD_UNIT_TOKENS) -> List[dict]:
+    """
+    Groups chunks by parent_topic and packs consecutive topics of the same file into units of
+    at most max_tokens (a larger topic is split into parts). Each unit is one Gemini call and
+    is cached under a hash of its content, so unchanged topics keep their cards.
+    """
+    topics = OrderedDict()
+    for chunk in chunks:
+        topics.setdefault((chunk["source"], chunk["topic"]), []).append(chunk["text"])
 
-    # Combine docs (Increase limit to cover more material)
-    full_context = "\n\n".join(docs[:40]) 
+    units = []
+    current = None
+    for (source, topic), texts in topics.items():
+        pieces, piece, piece_tokens = [], [], 0
+        for text in texts:
+            tokens = context_packing.estimate_text_tokens(text)
+            if piece and piece_tokens + tokens > max_tokens:
+                pieces.append(piece)
+                piece, piece_tokens = [], 0
+            piece.append(text)
+            piece_tokens += tokens
+        pieces.append(piece)
+
+        for piece in pieces:
+            section = f"## {topic}\n\n" + "\n\n".join(piece)
+            tokens = context_packing.estimate_text_tokens(section)
+            if current is None or current["source"] != source or current["tokens"] + tokens > max_tokens:
+                current = {"source": source, "topics": [], "sections": [], "tokens": 0}
+                units.append(current)
+            if topic not in current["topics"]:
+                current["topics"].append(topic)
+            current["sections"].append(section)
+            current["tokens"] += tokens
+
+    for unit in units:
+        digest = hashlib.sha256(f"{FLASHCARD_PROMPT_VERSION}\n".encode("utf-8"))
+        for section in unit["sections"]:
+            digest.update(section.encode("utf-8"))
+        unit["key"] = digest.hexdigest()
+    return units
+
+def build_unit_messages(unit: dict, language: str):
+    from langchain_core.messages import HumanMessage, SystemMessage
 
-    # 3. Generate with AI
     script_note = ""
     if language.lower() == "hindi":
         script_note = "STRICT: Use Devanagari script (हिन्दी) for explanations."
     elif language.lower() == "telugu":
         script_note = "STRICT: Use Telugu script (తెలుగు) ONLY. DO NOT USE ENGLISH ALPHABETS FOR TELUGU SENTENCES."
-        
+
     lang_instruction = f"Output language: {language}. {script_note} Remember: technical terms in English, explanations in native {language} script."
+    full_context = "\n\n".join(unit["sections"])
     prompt = f"Extract topics and generate revision flashcards from this text:\n\n{full_context}\n\n{lang_instruction}"
-    
-    messages = [
+    return [
         SystemMessage(content=FLASHCARD_SYSTEM_PROMPT),
         HumanMessage(content=prompt)
     ]
 
-    print(f"🪄 Generating {language} flashcards via AI for session {session_id}...")
-    response = generate_ai_response(messages)
-    
+def parse_flashcards(response_content: str) -> Optional[List[dict]]:
+    """Flashcard list from the model output, or None if it is not valid JSON."""
     try:
         # Clean response if AI adds markdown
-        clean_content = response.content.replace('```json', '').replace('```', '').strip()
-        data = json.loads(clean_content)
-        
-        # Cache for future use
-        os.makedirs(os.path.dirname(flashcard_cache_path), exist_ok=True)
-        with open(flashcard_cache_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-            
-        return data.get("flashcards", [])
+        clean_content = response_content.replace('```json', '').replace('```', '').strip()
+        return json.loads(clean_content).get("flashcards", [])
     except Exception as e:
-        print(f"❌ Failed to parse {language} flashcard JSON: {e}")
-        print(f"RAW CONTENT: {response.content}")
+        print(f"❌ Failed to parse flashcard JSON: {e}")
+        print(f"RAW CONTENT: {response_content}")
+        return None
+
+def build_translation_messages(cards: List[dict], language: str):
+    """Cheaper derivation of a language from the English cards of the same unit."""
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    prompt = (f"Translate these flashcards into {language}. Remember: technical terms in English, "
+              f"explanations in native {language} script.\n\n{json.dumps({'flashcards': cards}, ensure_ascii=False)}")
+    return [
+        SystemMessage(content=FLASHCARD_TRANSLATION_PROMPT),
+        HumanMessage(content=prompt)
+    ]
+
+def unit_messages(unit: dict, language: str, base_cards: Dict[str, list]):
+    """Translation of the cached English cards when available, otherwise full extraction."""
+    cards = base_cards.get(unit["key"])
+    if cards:
+        return build_translation_messages(cards, language)
+    return build_unit_messages(unit, language)
+
+def prepare_flashcards(session_id: str, language: str) -> Optional[dict]:
+    """
+    Plans the units of a session. Returns None if the session has no chunks, else
+    {units, cards (cached per unit key), base_cards (English, for translation), fingerprint}.
+    """
+    # Taken before reading chunks: if ingestion lands meanwhile, the result is already stale
+    fingerprint = session_content_fingerprint(session_id)
+    chunks = load_session_chunks(session_id)
+    if not chunks:
+        print(f"⚠️ No documents found for session {session_id}")
+        return None
+    units = plan_flashcard_units(chunks)
+    cards = load_topic_cache(session_id, language)
+    base_cards = load_topic_cache(session_id, BASE_LANGUAGE) if language.lower() != BASE_LANGUAGE else {}
+    missing = [unit for unit in units if unit["key"] not in cards]
+    translated = sum(1 for unit in missing if base_cards.get(unit["key"]))
+    print(f"🗂️ Flashcards ({language}): {len(units)} topic units, {len(units) - len(missing)} cached, "
+          f"{translated} to translate, {len(missing) - translated} to generate")
+    return {"units": units, "cards": cards, "base_cards": base_cards, "fingerprint": fingerprint}
+
+def finish_flashcards(session_id: str, language: str, plan: dict) -> List[dict]:
+    """Merges unit cards in document order and caches them. The merged file is only written
+    when every unit succeeded, so a failed unit is retried on the next request."""
+    units, cards_by_key = plan["units"], plan["cards"]
+    atomic_write_json(
+        get_topic_cache_path(session_id, language),
+        {"version": FLASHCARD_PROMPT_VERSION, "units": {u["key"]: cards_by_key[u["key"]] for u in units if u["key"] in cards_by_key}},
+        ensure_ascii=False, indent=2
+    )
+    merged, seen_topics = [], set()
+    for unit in units:
+        for card in cards_by_key.get(unit["key"], []):
+            # Per file: parts of a split topic collapse, while "Introduction" in each chapter stays
+            topic_key = (unit["source"], str(card.get("topic", "")).strip().lower())
+            if topic_key in seen_topics:
+                continue
+            seen_topics.add(topic_key)
+            merged.append(card)
+    if all(unit["key"] in cards_by_key for unit in units):
+        # Cache for future use (atomic, so readers never see a half-written file)
+        atomic_write_json(get_flashcard_cache_path(session_id, language),
+                          {"fingerprint": plan["fingerprint"], "flashcards": merged}, ensure_ascii=False, indent=2)
+    return merged
+
+def generate_flashcards(session_id: str, language: str = "english", priority: int = llm_gateway.PRIORITY_DEFAULT):
+    """
+    Generates topic-wise revision summaries from the ingested materials of a session.
+    """
+    # Check if already generated for this language
+    cached = load_cached_flashcards(session_id, language)
+    if cached is not None:
+        return cached
+
+    # Pre-generation and requests for the same language share one generation
+    with _flashcard_locks.hold((session_id, language.lower())):
+        cached = load_cached_flashcards(session_id, language)
+        if cached is not None:
+            return cached
+        return _generate_flashcards(session_id, language, priority)
+
+def _generate_flashcards(session_id: str, language: str, priority: int):
+    plan = prepare_flashcards(session_id, language)
+    if plan is None:
         return []
+    missing = [unit for unit in plan["units"] if unit["key"] not in plan["cards"]]
+
+    def generate_unit(unit):
+        try:
+            response = generate_ai_response(unit_messages(unit, language, plan["base_cards"]), priority=priority)
+        except Exception as e:
+            print(f"❌ Flashcard generation failed for {', '.join(unit['topics'])}: {e}")
+            return unit["key"], None
+        return unit["key"], parse_flashcards(response.content)
+
+    print(f"🪄 Generating {language} flashcards via AI for session {session_id}...")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=FLASHCARD_WORKERS) as executor:
+        for key, cards in executor.map(generate_unit, missing):
+            if cards is not None:
+                plan["cards"][key] = cards
+    return finish_flashcards(session_id, language, plan)
+
+async def agenerate_flashcards(session_id: str, language: str = "english"):
+    """Async generate_flashcards: Chroma and file I/O in the blocking pool, Gemini awaited."""
+    cached = await run_blocking(load_cached_flashcards, session_id, language)
+    if cached is not None:
+        return cached
+    return await _flashcard_flights.do((session_id, language.lower()), _agenerate_flashcards, session_id, language)
+
+async def _agenerate_flashcards(session_id: str, language: str):
+    async with _flashcard_locks.ahold((session_id, language.lower())):
+        # Re-check: a flight or pre-generation that finished meanwhile has written the cache
+        cached = await run_blocking(load_cached_flashcards, session_id, language)
+        if cached is not None:
+            return cached
+
+        plan = await run_blocking(prepare_flashcards, session_id, language)
+        if plan is None:
+            return []
+        semaphore = asyncio.Semaphore(FLASHCARD_WORKERS)
+
+        async def generate_unit(unit):
+            async with semaphore:
+                try:
+                    response = await agenerate_ai_response(unit_messages(unit, language, plan["base_cards"]))
+                except Exception as e:
+                    print(f"❌ Flashcard generation failed for {', '.join(unit['topics'])}: {e}")
+                    return
+            cards = parse_flashcards(response.content)
+            if cards is not None:
+                plan["cards"][unit["key"]] = cards
+
+        print(f"🪄 Generating {language} flashcards via AI for session {session_id}...")
+        await asyncio.gather(*(generate_unit(unit) for unit in plan["units"] if unit["key"] not in plan["cards"]))
+        return await run_blocking(finish_flashcards, session_id, language, plan)
+
+def prewarm_flashcards(session_id: str, directory_path: Optional[str] = None):
+    """
+    Post-ingestion hook: builds the English cards once, then derives the other languages
+    from them with translation-only calls, all at background priority.
+    """
+    print(f"🔥 Pre-building flashcards for session {session_id}")
+    for language in [BASE_LANGUAGE] + [l for l in FLASHCARD_PREWARM_LANGUAGES if l != BASE_LANGUAGE]:
+        generate_flashcards(session_id, language, priority=llm_gateway.PRIORITY_BACKGROUND)
 
 if __name__ == "__main__":
     # Test logic
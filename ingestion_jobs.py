@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import threading
+import concurrent.futures
+from typing import Callable, Dict, List, Optional
+from file_utils import atomic_write_json
+
+# --- CONFIG ---
+# Background ingestion queue: one job per session at a time, pending uploads for the same
+# session are merged into the queued (or a follow-up) run, and at most
+# MAX_CONCURRENT_INGESTIONS sessions are ingested at once.
+JOBS_FILE = os.path.join("data", "ingestion_jobs.json")
+MAX_CONCURRENT_INGESTIONS = int(os.getenv("MAX_CONCURRENT_INGESTIONS", "2"))
+# Completion hooks (flashcard/assessment pre-generation) run on their own small pool,
+# so they never hold an ingestion slot
+POST_INGESTION_WORKERS = int(os.getenv("POST_INGESTION_WORKERS", "1"))
+
+def _new_job(session_id: str, directory_path: str) -> dict:
+    return {
+        "session_id": session_id,
+        "directory": directory_path,
+        "state": "queued",            # queued -> running -> done | failed
+        "submitted_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "stage": None,
+        "stage_started_at": None,
+        "stages": {},                 # stage -> elapsed seconds (accumulated)
+        "files_total": 0,
+        "files_done": 0,
+        "current_file": None,
+        "coalesced_requests": 0,
+        "rerun_requested": False,
+        "runs": 0,
+        "error": None,
+        "previous_error": None        # Error of a failed pass that was followed by a re-run
+    }
+
+class IngestionScheduler:
+    def __init__(self, run_fn: Optional[Callable] = None, max_concurrent: int = MAX_CONCURRENT_INGESTIONS,
+                 jobs_file: str = JOBS_FILE):
+        self._run_fn = run_fn
+        self._jobs_file = jobs_file
+        self._lock = threading.RLock()
+        self._jobs: Dict[str, dict] = self._load()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrent, thread_name_prefix="ingestion"
+        )
+        self._completion_hooks: List[Callable] = []
+        self._active_hooks: Dict[str, int] = {}   # session_id -> hooks queued or running
+        self._hook_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=POST_INGESTION_WORKERS, thread_name_prefix="post-ingestion"
+        )
+
+    # --- persistence ---
+    def _load(self) -> Dict[str, dict]:
+        if not os.path.exists(self._jobs_file):
+            return {}
+        try:
+            with open(self._jobs_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"⚠️ Could not read ingestion job state: {e}")
+            return {}
+
+    def _persist(self):
+        try:
+            atomic_write_json(self._jobs_file, self._jobs, indent=2)
+        except Exception as e:
+            print(f"⚠️ Could not persist ingestion job state: {e}")
+
+    # --- public API ---
+    def submit(self, directory_path: str) -> dict:
+        """Queues ingestion of a session directory, merging with a pending or running job."""
+        session_id = os.path.basename(os.path.normpath(directory_path))
+        with self._lock:
+            job = self._jobs.get(session_id)
+            if job and job["state"] == "queued":
+                job["coalesced_requests"] += 1
+                print(f"🔗 Merged ingestion request into queued job for session {session_id}")
+            elif job and job["state"] == "running":
+                # New files arrived mid-run: run once more when the current pass ends
+                job["coalesced_requests"] += 1
+                job["rerun_requested"] = True
+                print(f"🔁 Session {session_id} is ingesting; scheduled one follow-up pass")
+            else:
+                job = _new_job(session_id, directory_path)
+                self._jobs[session_id] = job
+                self._executor.submit(self._run, session_id)
+            self._persist()
+            return self.status(session_id)
+
+    def on_complete(self, hook: Callable):
+        """Registers hook(session_id, directory_path), called after each successful ingestion."""
+        self._completion_hooks.append(hook)
+
+    def _run_hook(self, hook: Callable, session_id: str, directory_path: str):
+        try:
+            hook(session_id, directory_path)
+        except Exception as e:
+            print(f"❌ Post-ingestion hook {getattr(hook, '__name__', hook)} failed for session {session_id}: {e}")
+        finally:
+            with self._lock:
+                self._active_hooks[session_id] -= 1
+                if not self._active_hooks[session_id]:
+                    del self._active_hooks[session_id]
+
+    def hooks_pending(self, session_id: str) -> int:
+        """Completion hooks queued or running for a session."""
+        with self._lock:
+            return self._active_hooks.get(session_id, 0)
+
+    def status(self, session_id: str) -> Optional[dict]:
+        """Snapshot of a session's job, with the elapsed time of the current stage filled in."""
+        with self._lock:
+            job = self._jobs.get(session_id)
+            if job is None:
+                return None
+            snapshot = json.loads(json.dumps(job))
+            now = time.time()
+            if job["state"] == "running" and job["stage"]:
+                stages = snapshot["stages"]
+                stages[job["stage"]] = stages.get(job["stage"], 0.0) + now - job["stage_started_at"]
+            if job["started_at"]:
+                snapshot["elapsed_seconds"] = (job["finished_at"] or now) - job["started_at"]
+            return snapshot
+
+    def recover(self):
+        """Re-queues jobs that were queued or running when the process last stopped."""
+        with self._lock:
+            for session_id, job in self._jobs.items():
+                if job["state"] in ("queued", "running"):
+                    print(f"♻️ Resuming interrupted ingestion for session {session_id}")
+                    job.update(state="queued", stage=None, stage_started_at=None)
+                    self._executor.submit(self._run, session_id)
+            self._persist()
+
+    # --- worker ---
+    @staticmethod
+    def _close_stage(job: dict, now: float):
+        if job["stage"]:
+            job["stages"][job["stage"]] = job["stages"].get(job["stage"], 0.0) + now - job["stage_started_at"]
+
+    def _progress(self, session_id: str, stage: Optional[str] = None, **info):
+        with self._lock:
+            job = self._jobs[session_id]
+            now = time.time()
+            changed = False
+            if stage and stage != job["stage"]:
+                self._close_stage(job, now)
+                job["stage"] = stage
+                job["stage_started_at"] = now
+                changed = True
+            for key in ("files_total", "files_done", "current_file"):
+                if key in info and job.get(key) != info[key]:
+                    job[key] = info[key]
+                    changed = True
+            if changed:
+                # At most a few writes per file, so the status survives a restart
+                self._persist()
+
+    def _run(self, session_id: str):
+        run_fn = self._run_fn
+        if run_fn is None:
+            from ingestion_pipeline import ingest_directory as run_fn
+
+        while True:
+            with self._lock:
+                job = self._jobs[session_id]
+                job.update(state="running", started_at=job["started_at"] or time.time(),
+                           rerun_requested=False, error=None)
+                job["runs"] += 1
+                self._persist()
+            try:
+                run_fn(job["directory"], progress=lambda stage=None, **info: self._progress(session_id, stage, **info))
+                failed = None
+            except Exception as e:
+                print(f"❌ Ingestion failed for session {session_id}: {e}")
+                failed = str(e)
+
+            with self._lock:
+                self._close_stage(job, time.time())
+                job.update(stage=None, stage_started_at=None)
+                if job["rerun_requested"]:
+                    # Files uploaded mid-run still get their pass, even if this one failed
+                    if failed:
+                        job["previous_error"] = failed
+                        print(f"🔁 Running the follow-up pass for session {session_id} despite the failure")
+                    continue
+                job.update(state="failed" if failed else "done", error=failed,
+                           finished_at=time.time(), stage=None, stage_started_at=None, current_file=None)
+                self._persist()
+                if failed is None:
+                    for hook in self._completion_hooks:
+                        self._active_hooks[session_id] = self._active_hooks.get(session_id, 0) + 1
+                        self._hook_executor.submit(self._run_hook, hook, session_id, job["directory"])
+                return
+
+scheduler = IngestionScheduler()
+
+def submit(directory_path: str) -> dict:
+    return scheduler.submit(directory_path)
+
+def get_status(session_id: str) -> Optional[dict]:
+    return scheduler.status(session_id)
+
+def on_complete(hook: Callable):
+    scheduler.on_complete(hook)
+
+def hooks_pending(session_id: str) -> int:
+    return scheduler.hooks_pending(session_id)
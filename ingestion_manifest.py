@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import hashlib
+from typing import Dict, List, Optional, Tuple
+from file_utils import atomic_write_json
+
+# Per-session record of what has been ingested, keyed by file content hash:
+# {"version": 1, "files": {"<sha256>": {"source", "aliases", "chunk_ids", "ingested_at"}}}
+MANIFEST_NAME = "ingestion_manifest.json"
+MANIFEST_VERSION = 1
+
+def manifest_path(directory_path: str) -> str:
+    return os.path.join(directory_path, MANIFEST_NAME)
+
+def new_manifest() -> dict:
+    return {"version": MANIFEST_VERSION, "files": {}}
+
+def load_manifest(directory_path: str) -> Optional[dict]:
+    """Returns the session manifest, or None if this session has never written one."""
+    path = manifest_path(directory_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        manifest.setdefault("files", {})
+        return manifest
+    except Exception as e:
+        print(f"⚠️ Corrupt ingestion manifest at {path}, starting fresh: {e}")
+        return new_manifest()
+
+def save_manifest(directory_path: str, manifest: dict):
+    manifest["updated_at"] = time.time()
+    atomic_write_json(manifest_path(directory_path), manifest, indent=2)
+
+def content_fingerprint(manifest: Optional[dict]) -> Optional[str]:
+    """
+    Hash of what is stored for a session (file content hashes and their chunk counts).
+    Unchanged by renames; None when nothing has been ingested.
+    """
+    if not manifest or not manifest["files"]:
+        return None
+    digest = hashlib.sha256()
+    for file_hash in sorted(manifest["files"]):
+        digest.update(f"{file_hash}:{len(manifest['files'][file_hash]['chunk_ids'])}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def make_chunk_ids(session_id: str, file_hash: str, count: int) -> List[str]:
+    """Deterministic chunk IDs, so re-ingesting the same file upserts instead of duplicating."""
+    return [f"{session_id}:{file_hash[:16]}:{i}" for i in range(count)]
+
+def record_file(manifest: dict, file_hash: str, source: str, chunk_ids: List[str], **extra):
+    manifest["files"][file_hash] = {
+        "source": source,
+        "aliases": [],
+        "chunk_ids": list(chunk_ids),
+        "ingested_at": time.time(),
+        **extra
+    }
+
+def find_entry(manifest: Optional[dict], filename: str) -> Tuple[Optional[str], Optional[dict]]:
+    """Looks up the manifest entry that covers `filename` (as source or duplicate alias)."""
+    if not manifest:
+        return None, None
+    for file_hash, entry in manifest["files"].items():
+        if entry.get("source") == filename or filename in entry.get("aliases", []):
+            return file_hash, entry
+    return None, None
+
+def plan_ingestion(manifest: dict, current_files: Dict[str, str]) -> dict:
+    """
+    Diffs the files currently on disk ({filename: content_hash}) against the manifest.
+
+    Returns:
+        ingest:    {filename: hash} for content never ingested (new, edited or previously empty files)
+        unchanged: filenames whose content is already in the store
+        renamed:   [(hash, old_source, new_source)] for content that moved to a new name
+        stale:     hashes no longer present on disk, whose chunks must be removed
+    """
+    by_hash = {}
+    for filename in sorted(current_files):
+        by_hash.setdefault(current_files[filename], []).append(filename)
+
+    entries = manifest["files"]
+    plan = {"ingest": {}, "unchanged": [], "renamed": [], "stale": []}
+    for file_hash, names in by_hash.items():
+        entry = entries.get(file_hash)
+        if entry is None or not entry["chunk_ids"]:
+            # Never ingested, or checkpointed empty by an older version: (re)try it
+            plan["ingest"][names[0]] = file_hash
+        elif entry["source"] in names:
+            plan["unchanged"].append(entry["source"])
+        else:
+            plan["renamed"].append((file_hash, entry["source"], names[0]))
+    plan["stale"] = [h for h in entries if h not in by_hash]
+    return plan
+
+def update_aliases(manifest: dict, current_files: Dict[str, str]):
+    """Records identical copies uploaded under other names against the canonical entry."""
+    for entry in manifest["files"].values():
+        entry["aliases"] = []
+    for filename in sorted(current_files):
+        entry = manifest["files"].get(current_files[filename])
+        if entry and entry["source"] != filename:
+            entry["aliases"].append(filename)
@@ -1,14 +1,23 @@
 import os
 import json
 import re
-from typing import List
+from typing import Callable, List, Dict, Optional, Tuple
 from topic_mapper import group_elements_by_topic
-from unstructured.partition.pdf import partition_pdf
+from file_utils import file_sha256
+from blob_store import make_original_content
+from parse_cache import partition_cached, load_cache_info
+from adaptive_partition import partition_adaptive
+from ingestion_manifest import (
+    load_manifest,
+    save_manifest,
+    new_manifest,
+    make_chunk_ids,
+    record_file,
+    plan_ingestion,
+    update_aliases
+)
 from unstructured.chunking.title import chunk_by_title
 from langchain_core.documents import Document
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_chroma import Chroma
 from langchain_core.messages import HumanMessage
 from dotenv import load_dotenv
 from tenacity import (
@@ -17,27 +26,36 @@ from tenacity import (
     wait_exponential,
     retry_if_exception_type
 )
+import multiprocessing
 import concurrent.futures
-import threading
+import lexical_index
+import llm_gateway
+import summary_cache
+import vector_store
 
-# Global semaphore to limit TOTAL concurrent API calls across all files
-# Tier 1 has 2000 RPM but 1M TPM. Keeping this low prevents hitting the TPM limit with large chunks.
-api_semaphore = threading.BoundedSemaphore(3)
+# All Gemini calls go through the process-wide llm_gateway (RPM/TPM buckets + priorities),
+# which replaces the old ingestion-only api_semaphore.
 # Note: Google's 429 error is often wrapped in an InternalServerError or similar in LangChain,
 # but we can retry on general exceptions if they look like rate limits.
 
 load_dotenv(override=True)
 
 # --- CONFIGURATION ---
-# Using local embeddings to avoid 429 rate limits during bulk upload
-
-LOCAL_EMBEDDINGS = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-CHROMA_PATH = "./chroma_db"
-
-# GEMINI_MODEL = "gemini-2.5-flash"  # Use for high-quality showcase
-GEMINI_MODEL = "gemini-2.0-flash"  # Use for cost-effective testing
-
-llm = ChatGoogleGenerativeAI(model=GEMINI_MODEL, temperature=0)
+# Embeddings and Chroma handles come from the shared vector_store registry
+
+# Worker processes for partitioning/chunking files in parallel (1 = serial)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+# Chunks embedded and upserted per Chroma write while streaming ingestion
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "64"))
+# "adaptive" runs hi_res only on pages with images/tables; "hi_res" runs it on every page
+PARTITION_STRATEGY = os.getenv("PARTITION_STRATEGY", "adaptive")
+# Summary requests are packed up to these estimated budgets, across a "file" or the whole "session"
+SUMMARY_BATCH_TOKENS = int(os.getenv("SUMMARY_BATCH_TOKENS", "24000"))
+SUMMARY_BATCH_IMAGES = int(os.getenv("SUMMARY_BATCH_IMAGES", "8"))
+SUMMARY_BATCH_MAX_BLOCKS = int(os.getenv("SUMMARY_BATCH_MAX_BLOCKS", "16"))
+SUMMARY_BATCH_SCOPE = os.getenv("SUMMARY_BATCH_SCOPE", "file")
+SUMMARY_TOKENS_PER_BLOCK = 150 # Expected answer length per block
+SUMMARY_WORKERS = 2
 
 # --- CORE FUNCTIONS (Replicated from your notebook) ---
 
@@ -57,37 +75,50 @@ def is_valid_pdf(file_path: str) -> bool:
         return False
 
 
-def partitioning_documents(file_path: str):
-    """Safely extract elements from PDF with fallback strategies."""
+HI_RES_KWARGS = dict(
+    infer_table_structure=True,
+    extract_image_block_types=["Image"],
+    extract_image_block_to_payload=True,
+)
+
+def partitioning_documents(file_path: str, stats: Optional[dict] = None):
+    """
+    Safely extract elements from PDF with fallback strategies.
+    If a `stats` dict is given it is filled with how many pages went through each strategy.
+    """
     print(f"📄 Partitioning: {file_path}")
+    if stats is None:
+        stats = {}
 
     if not is_valid_pdf(file_path):
         print(f"❌ Skipping invalid PDF: {file_path}")
         return []
 
     try:
-        # Primary (best quality)
-        return partition_pdf(
-            filename=file_path,
-            strategy="hi_res",
-            infer_table_structure=True,
-            extract_image_block_types=["Image"],
-            extract_image_block_to_payload=True,
-        )
+        # Primary (best quality): hi_res on every page, or only on pages with images/tables
+        if PARTITION_STRATEGY == "adaptive":
+            elements = partition_cached(file_path, "adaptive", partition_fn=partition_adaptive, **HI_RES_KWARGS)
+            stats.update(load_cache_info(file_path, "adaptive"))
+        else:
+            elements = partition_cached(file_path, "hi_res", **HI_RES_KWARGS)
+            stats.update(strategy="hi_res", hi_res_pages=len(_page_numbers(elements)), fast_pages=0)
+        return elements
 
     except Exception as e:
-        print(f"⚠️ hi_res failed, falling back: {e}")
+        print(f"⚠️ {PARTITION_STRATEGY} failed, falling back: {e}")
 
         try:
             # Fallback (text-only, very stable)
-            return partition_pdf(
-                filename=file_path,
-                strategy="fast",
-            )
+            elements = partition_cached(file_path, "fast")
+            stats.update(strategy="fast", hi_res_pages=0, fast_pages=len(_page_numbers(elements)))
+            return elements
         except Exception as e:
             print(f"❌ Failed to process PDF entirely: {e}")
             return []
 
+def _page_numbers(elements) -> set:
+    return {el.metadata.page_number for el in elements if getattr(el.metadata, "page_number", None)}
+
 
 def create_chunks_by_title(elements):
     """Uses your specific chunking strategy from the notebook."""
@@ -124,191 +155,444 @@ def separate_content_types(chunk):
     retry=retry_if_exception_type(Exception),
     before_sleep=lambda retry_state: print(f"⚠️ API Limit hit. Retrying in {retry_state.next_action.sleep} seconds...")
 )
-def create_batch_ai_summaries(batch_contents: List[dict]) -> List[str]:
-    """Processes a batch of content blocks in a single Gemini call."""
-    with api_semaphore: # Limit total concurrent calls
-        if not batch_contents:
-            return []
+def create_batch_ai_summaries(batch_contents: List[dict]) -> Optional[List[str]]:
+    """
+    Processes a batch of content blocks in a single Gemini call (background priority in the LLM gateway).
+    Returns None when the answer is not a JSON array with one summary per block.
+    """
+    if not batch_contents:
+        return []
 
-        prompt_text = (
-            "You are an expert at analyzing mixed-content chunks from technical documents for a RAG system.\n"
-            "Below are several content blocks. For each block, provide a concise summary that captures "
-            "the key facts, concepts, and data. Respond with a JSON array of strings, where each string "
-            "is the summary for the corresponding block.\n\n"
-        )
-        
-        message_content = [{"type": "text", "text": prompt_text}]
+    prompt_text = (
+        "You are an expert at analyzing mixed-content chunks from technical documents for a RAG system.\n"
+        "Below are several content blocks. For each block, provide a concise summary that captures "
+        "the key facts, concepts, and data. Respond with a JSON array of strings, where each string "
+        "is the summary for the corresponding block.\n\n"
+    )
+    
+    message_content = [{"type": "text", "text": prompt_text}]
+    
+    for i, content in enumerate(batch_contents):
+        block_desc = f"--- BLOCK {i+1} ---\nTEXT:\n{content['text']}\n"
+        if content['tables']:
+            block_desc += f"TABLES:\n{chr(10).join(content['tables'])}\n"
         
-        for i, content in enumerate(batch_contents):
-            block_desc = f"--- BLOCK {i+1} ---\nTEXT:\n{content['text']}\n"
-            if content['tables']:
-                block_desc += f"TABLES:\n{chr(10).join(content['tables'])}\n"
-            
-            message_content.append({"type": "text", "text": block_desc})
-            for img_b64 in content['images']:
-                message_content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"}})
-
-        try:
-            # Request JSON output
-            response = llm.invoke([HumanMessage(content=message_content)])
-            content_out = response.content.strip()
-            
-            # Strip markdown code blocks if present
-            if content_out.startswith("```json"):
-                content_out = content_out[7:-3].strip()
-            elif content_out.startswith("```"):
-                content_out = content_out[3:-3].strip()
-                
-            summaries = json.loads(content_out)
-            if isinstance(summaries, list) and len(summaries) == len(batch_contents):
-                return [str(s) for s in summaries]
-            else:
-                print(f"⚠️ Unexpected JSON format from LLM: {content_out}")
-                return [c['text'] for c in batch_contents]
-                
-        except Exception as e:
-            print(f"❌ Gemini summary failed: {e}")
-            return [c['text'] for c in batch_contents]
+        message_content.append({"type": "text", "text": block_desc})
+        for img_b64 in content['images']:
+            message_content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"}})
+
+    # Request JSON output. API errors propagate so the retry policy above can back off.
+    response = llm_gateway.invoke([HumanMessage(content=message_content)], temperature=0,
+                                  priority=llm_gateway.PRIORITY_BACKGROUND,
+                                  output_tokens=len(batch_contents) * SUMMARY_TOKENS_PER_BLOCK)
+    content_out = response.content.strip()
+
+    # Strip markdown code blocks if present
+    if content_out.startswith("```json"):
+        content_out = content_out[7:-3].strip()
+    elif content_out.startswith("```"):
+        content_out = content_out[3:-3].strip()
 
-def is_already_ingested(filename: str, session_id: str) -> bool:
-    """Checks ChromaDB to see if this file has already been processed for this session."""
     try:
-        db = Chroma(
-            persist_directory=CHROMA_PATH,
-            embedding_function=LOCAL_EMBEDDINGS,
-            collection_name="hackathon_collection"
-        )
-        results = db.get(where={"$and": [{"source": filename}, {"session_id": session_id}]})
-        return len(results['ids']) > 0
-    except Exception:
-        return False
-
-def process_files_to_docs(directory_path: str) -> List[Document]:
-    """Iterates through all PDFs in the session directory with batching, locking, and checkpointing."""
-    all_docs = []
+        summaries = json.loads(content_out)
+    except json.JSONDecodeError:
+        summaries = None
+    if isinstance(summaries, list) and len(summaries) == len(batch_contents):
+        return [str(s) for s in summaries]
+    print(f"⚠️ Unexpected JSON format from LLM for {len(batch_contents)} blocks: {content_out[:200]}")
+    return None
+
+def summarize_batch(batch_contents: List[dict]) -> List[Optional[str]]:
+    """
+    Summarizes one planned batch. If the LLM returns a mismatched array the batch is split
+    in half and retried, down to single blocks; blocks that still fail come back as None.
+    """
+    try:
+        summaries = create_batch_ai_summaries(batch_contents)
+    except Exception as e:
+        print(f"❌ Gemini summary failed: {e}")
+        return [None] * len(batch_contents)
+    if summaries is not None:
+        return summaries
+    if len(batch_contents) == 1:
+        return [None]
+    mid = len(batch_contents) // 2
+    print(f"✂️ Splitting summary batch of {len(batch_contents)} into {mid} + {len(batch_contents) - mid}")
+    return summarize_batch(batch_contents[:mid]) + summarize_batch(batch_contents[mid:])
+
+def estimate_chunk_tokens(content: dict) -> int:
+    """Estimated prompt + answer tokens one block adds to a summary request."""
+    chars = len(content['text']) + sum(len(t) for t in content['tables'])
+    return (chars // llm_gateway.CHARS_PER_TOKEN
+            + len(content['images']) * llm_gateway.IMAGE_TOKENS
+            + SUMMARY_TOKENS_PER_BLOCK)
+
+def plan_summary_batches(chunk_data_list: List[dict], indices: List[int],
+                         max_tokens: int = None, max_images: int = None,
+                         max_blocks: int = None) -> List[List[int]]:
+    """
+    Greedily packs the given chunk indices (in order) into batches that stay within an
+    estimated-token, image-count and block-count budget. A block that alone exceeds the
+    budget gets a batch of its own.
+    """
+    max_tokens = max_tokens or SUMMARY_BATCH_TOKENS
+    max_images = max_images or SUMMARY_BATCH_IMAGES
+    max_blocks = max_blocks or SUMMARY_BATCH_MAX_BLOCKS
+
+    batches = []
+    current, tokens, images = [], 0, 0
+    for idx in indices:
+        content = chunk_data_list[idx]
+        block_tokens = estimate_chunk_tokens(content)
+        block_images = len(content['images'])
+        if current and (tokens + block_tokens > max_tokens
+                        or images + block_images > max_images
+                        or len(current) >= max_blocks):
+            batches.append(current)
+            current, tokens, images = [], 0, 0
+        current.append(idx)
+        tokens += block_tokens
+        images += block_images
+    if current:
+        batches.append(current)
+    return batches
+
+def extract_file_chunks(file_path: str) -> Tuple[List[dict], dict]:
+    """
+    CPU-bound half of ingestion: partitions one PDF, maps it to topics and chunks it.
+    Runs inside a worker process in parallel mode, so it only returns plain dicts:
+    (chunk contents, partition stats).
+    """
+    stats = {}
+    elements = partitioning_documents(file_path, stats)
+    if not elements:
+        return [], stats
+    print(f"✅ Partitioning complete: {len(elements)} elements found.")
+
+    # Map Elements to Topics (Hierarchical Grouping)
+    topics = group_elements_by_topic(elements)
+    print(f"✅ Topic mapping complete: {len(topics)} major topics identified.")
+
+    chunk_data_list = []
+    for topic in topics:
+        # Chunk elements within this topic
+        for chunk in create_chunks_by_title(topic["elements"]):
+            content = separate_content_types(chunk)
+            content['parent_topic'] = topic["title"] # Attach parent topic info
+            chunk_data_list.append(content)
+    return chunk_data_list, stats
+
+def summarize_multimodal_chunks(chunk_data_list: List[dict]):
+    """
+    Adds an 'ai_summary' to every multimodal chunk of the list (one file or a whole session).
+    Summaries already in the persistent summary cache are reused; the rest are packed into
+    token/image-budgeted batches across topics. Runs in the main process.
+    """
+    multimodal_indices = [idx for idx, content in enumerate(chunk_data_list) if len(content['types']) > 1]
+    if not multimodal_indices:
+        return
+
+    keys = {idx: summary_cache.summary_key(chunk_data_list[idx], llm_gateway.GEMINI_MODEL) for idx in multimodal_indices}
+    cached = summary_cache.get_many(list(set(keys.values())))
+    missing = []
+    for idx in multimodal_indices:
+        if keys[idx] in cached:
+            chunk_data_list[idx]['ai_summary'] = cached[keys[idx]]
+        else:
+            missing.append(idx)
+    if len(missing) < len(multimodal_indices):
+        print(f"♻️ Reused {len(multimodal_indices) - len(missing)} cached summaries")
+    if not missing:
+        return
+
+    batches = plan_summary_batches(chunk_data_list, missing)
+    print(f"🤖 Summarizing {len(missing)} multimodal chunks in {len(batches)} requests...")
+
+    def process_batch(batch_idxs):
+        return batch_idxs, summarize_batch([chunk_data_list[idx] for idx in batch_idxs])
+
+    fresh = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=SUMMARY_WORKERS) as executor:
+        for batch_idxs, summaries in executor.map(process_batch, batches):
+            for idx, summary in zip(batch_idxs, summaries):
+                if summary is None:
+                    # Failed blocks fall back to their raw text and are not cached
+                    chunk_data_list[idx]['ai_summary'] = chunk_data_list[idx]['text']
+                else:
+                    chunk_data_list[idx]['ai_summary'] = summary
+                    fresh[keys[idx]] = summary
+    summary_cache.put_many(fresh)
+
+def build_documents(chunk_data_list: List[dict], file_path: str, session_id: str, file_hash: str) -> List[Document]:
+    """Converts processed chunk dicts of one file into LangChain Documents with stable IDs."""
+    filename = os.path.basename(file_path)
+    timestamp = get_file_timestamp(file_path)
+    chunk_ids = make_chunk_ids(session_id, file_hash, len(chunk_data_list))
+    docs = []
+    for chunk_id, content in zip(chunk_ids, chunk_data_list):
+        topic_title = content['parent_topic']
+        raw_text = content['text']
+        ai_summary = content.get('ai_summary', '')
+
+        if ai_summary:
+            indexed_content = f"TOPIC: {topic_title}\nSUMMARY: {ai_summary}\n\nORIGINAL TEXT: {raw_text}"
+        else:
+            indexed_content = f"TOPIC: {topic_title}\n\n{raw_text}"
+
+        docs.append(Document(
+            id=chunk_id,
+            page_content=indexed_content,
+            metadata={
+                "session_id": session_id,
+                "source": filename,
+                "content_hash": file_hash,
+                "parent_topic": topic_title,
+                "timestamp": timestamp,
+                # Images/tables live in the blob store; metadata only keeps their references
+                "original_content": make_original_content(raw_text, content['tables'], content['images'])
+            }
+        ))
+    return docs
+
+def _no_progress(stage: Optional[str] = None, **info):
+    pass
+
+def iter_file_documents(directory_path: str, max_workers: Optional[int] = None,
+                        file_hashes: Optional[Dict[str, str]] = None, progress: Callable = _no_progress):
+    """
+    Processes PDFs of the session directory, yielding (filename, file_hash, documents, stats)
+    per file, where stats are the page-level partition stats.
+
+    file_hashes ({filename: content_hash}) selects which files to process; by default every
+    PDF in the directory is processed. With max_workers > 1 (default: INGEST_WORKERS)
+    partitioning and chunking run in a bounded process pool. Summaries are still requested
+    from this process through the LLM gateway, and files are yielded in sorted filename order
+    so both modes produce the same output. Only one file's documents are held at a time.
+    progress(stage, **info) is told when each file enters partitioning and summarizing.
+    """
     session_id = os.path.basename(directory_path)
-    
-    files = [f for f in os.listdir(directory_path) if f.lower().endswith(".pdf")]
-    total_files = len(files)
-    
-    print(f"🚀 Starting ingestion for {total_files} files in session {session_id}")
+    if max_workers is None:
+        max_workers = INGEST_WORKERS
+    if file_hashes is None:
+        file_hashes = {
+            f: file_sha256(os.path.join(directory_path, f))
+            for f in os.listdir(directory_path) if f.lower().endswith(".pdf")
+        }
 
-    for idx, filename in enumerate(files):
+    pending = sorted(file_hashes)
+    total_files = len(pending)
+
+    print(f"🚀 Starting ingestion for {total_files} files in session {session_id}")
+    if not pending:
+        return
+
+    def extracted_files():
+        if max_workers > 1 and total_files > 1:
+            workers = min(max_workers, total_files)
+            print(f"⚙️ Partitioning {total_files} files with {workers} worker processes")
+            # spawn, not fork: this runs on a scheduler thread of a multi-threaded server, and a
+            # forked child could inherit a lock (parse cache, gateway, torch) held by another thread
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                        mp_context=multiprocessing.get_context("spawn")) as executor:
+                futures = [executor.submit(extract_file_chunks, os.path.join(directory_path, f)) for f in pending]
+                # Consume in submission order: later files keep partitioning while earlier ones are summarized
+                for idx, filename in enumerate(pending):
+                    progress("partitioning", current_file=filename)
+                    try:
+                        chunk_data_list, stats = futures[idx].result()
+                    except Exception as e:
+                        print(f"❌ Worker failed on {filename}: {e}")
+                        chunk_data_list, stats = [], {"error": str(e)}
+                    futures[idx] = None # Release the worker result once consumed
+                    yield idx, filename, chunk_data_list, stats
+        else:
+            for idx, filename in enumerate(pending):
+                progress("partitioning", current_file=filename)
+                chunk_data_list, stats = extract_file_chunks(os.path.join(directory_path, filename))
+                yield idx, filename, chunk_data_list, stats
+
+    def finish_file(idx, filename, chunk_data_list, stats):
         print(f"\n--- 📄 Processing File {idx+1}/{total_files}: {filename} ---")
-        
-        # --- CHECKPOINTING: Skip if already in DB ---
-        if is_already_ingested(filename, session_id):
-            print(f"⏭️ Skipping {filename}: Already fully ingested in this session.")
-            continue
-            
+        if not chunk_data_list:
+            print(f"⚠️ Skipping {filename}: No elements extracted.")
+            return filename, file_hashes[filename], [], stats
+        if SUMMARY_BATCH_SCOPE != "session":
+            progress("summarizing", current_file=filename)
+            summarize_multimodal_chunks(chunk_data_list)
         file_path = os.path.join(directory_path, filename)
+        return filename, file_hashes[filename], build_documents(chunk_data_list, file_path, session_id, file_hashes[filename]), stats
+
+    if SUMMARY_BATCH_SCOPE == "session":
+        # Pack summary requests across every file; writes start once all files are extracted
+        extracted = list(extracted_files())
+        progress("summarizing", current_file=None)
+        summarize_multimodal_chunks([content for _, _, chunks, _ in extracted for content in chunks])
+        for item in extracted:
+            yield finish_file(*item)
+    else:
+        for item in extracted_files():
+            yield finish_file(*item)
 
-        # 1. Partition
-        elements = partitioning_documents(file_path)
-        if not elements:
-            print(f"⚠️ Skipping {filename}: No elements extracted.")
-            continue
-        print(f"✅ Partitioning complete: {len(elements)} elements found.")
-        
-        # 2. Map Elements to Topics (Hierarchical Grouping)
-        topics = group_elements_by_topic(elements)
-        print(f"✅ Topic mapping complete: {len(topics)} major topics identified.")
-
-        topic_docs = []
-        for topic in topics:
-            topic_title = topic["title"]
-            topic_elements = topic["elements"]
-
-            # 3. Chunk elements within this topic
-            chunks = create_chunks_by_title(topic_elements)
-            
-            # 4. Prepare contents and identify batch candidates
-            chunk_data_list = []
-            multimodal_indices = []
-            
-            for i, chunk in enumerate(chunks):
-                content = separate_content_types(chunk)
-                content['parent_topic'] = topic_title # Attach parent topic info
-                chunk_data_list.append(content)
-                if len(content['types']) > 1:
-                    multimodal_indices.append(len(chunk_data_list) - 1)
-            
-            # 5. Process Multimodal Chunks in Parallel Batches for this Topic
-            batch_size = 5
-            if multimodal_indices:
-                print(f"🤖 Processing {len(multimodal_indices)} multimodal chunks in topic: {topic_title}...")
-                
-                batches = []
-                for i in range(0, len(multimodal_indices), batch_size):
-                    batch_idxs = multimodal_indices[i : i + batch_size]
-                    batches.append((batch_idxs, [chunk_data_list[idx] for idx in batch_idxs]))
-
-                def process_batch(batch_data):
-                    idxs, contents = batch_data
-                    summaries = create_batch_ai_summaries(contents)
-                    return idxs, summaries
-
-                with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-                    results = list(executor.map(process_batch, batches))
-
-                    for batch_idxs, summaries in results:
-                        for idx, summary in zip(batch_idxs, summaries):
-                            chunk_data_list[idx]['ai_summary'] = summary
-
-            # 6. Convert to LangChain Documents for this Topic
-            for content in chunk_data_list:
-                raw_text = content['text']
-                ai_summary = content.get('ai_summary', '')
-                
-                if ai_summary:
-                    indexed_content = f"TOPIC: {topic_title}\nSUMMARY: {ai_summary}\n\nORIGINAL TEXT: {raw_text}"
-                else:
-                    indexed_content = f"TOPIC: {topic_title}\n\n{raw_text}"
-
-                doc = Document(
-                    page_content=indexed_content,
-                    metadata={
-                        "session_id": session_id,
-                        "source": filename,
-                        "parent_topic": topic_title,
-                        "timestamp": get_file_timestamp(file_path),
-                        "original_content": json.dumps({
-                            "raw_text": raw_text,
-                            "tables_html": content['tables'],
-                            "images_base64": content['images']
-                        })
-                    }
-                )
-                all_docs.append(doc)
-            
-        # 6. Inter-file cooldown (Removed for Tier 1)
-        pass
-            
+def process_files_to_docs(directory_path: str, max_workers: Optional[int] = None,
+                          file_hashes: Optional[Dict[str, str]] = None) -> List[Document]:
+    """Collects every document of iter_file_documents into one list (for inspection and tests)."""
+    all_docs = []
+    for _, _, docs, _ in iter_file_documents(directory_path, max_workers=max_workers, file_hashes=file_hashes):
+        all_docs.extend(docs)
     return all_docs
 
-def create_vector_store(documents: List[Document]):
-    """Stores documents in a persistent local ChromaDB."""
-    print(f"Storing {len(documents)} chunks in ChromaDB...")
-    return Chroma.from_documents(
-        documents=documents,
-        embedding=LOCAL_EMBEDDINGS,
-        persist_directory=CHROMA_PATH,
-        collection_name="hackathon_collection"
-    )
+def upsert_documents(db, documents: List[Document], batch_size: int = UPSERT_BATCH_SIZE):
+    """Embeds and upserts documents into ChromaDB in bounded batches."""
+    for i in range(0, len(documents), batch_size):
+        batch = documents[i : i + batch_size]
+        with vector_store.write_lock:
+            db.add_documents(batch, ids=[doc.id for doc in batch])
+    print(f"💾 Stored {len(documents)} chunks in ChromaDB")
+
+def adopt_legacy_chunks(db, session_id: str, current_files: Dict[str, str]) -> dict:
+    """
+    Builds a first manifest for sessions ingested before manifests existed,
+    by claiming the chunks already stored for each file name.
+    """
+    manifest = new_manifest()
+    for filename, file_hash in current_files.items():
+        try:
+            results = db.get(where={"$and": [{"source": filename}, {"session_id": session_id}]}, include=[])
+        except Exception as e:
+            print(f"⚠️ Could not inspect existing chunks for {filename}: {e}")
+            continue
+        if results['ids']:
+            record_file(manifest, file_hash, filename, results['ids'])
+            print(f"📒 Adopted {len(results['ids'])} existing chunks for {filename}")
+    return manifest
+
+def apply_manifest_plan(db, plan: dict, manifest: dict, session_id: str) -> List[str]:
+    """
+    Removes chunks of deleted/edited files and re-points chunks of renamed files
+    (a metadata-only update, so nothing is re-embedded). Returns the removed chunk ids.
+    """
+    removed = []
+    for file_hash in plan["stale"]:
+        entry = manifest["files"].pop(file_hash)
+        if entry["chunk_ids"]:
+            db.delete(ids=entry["chunk_ids"])
+        removed.extend(entry["chunk_ids"])
+        print(f"🗑️ Removed {len(entry['chunk_ids'])} chunks of {entry['source']} (deleted or changed)")
+
+    for file_hash, old_source, new_source in plan["renamed"]:
+        entry = manifest["files"][file_hash]
+        if entry["chunk_ids"]:
+            existing = db.get(ids=entry["chunk_ids"], include=["metadatas"])
+            metadatas = [{**m, "source": new_source} for m in existing["metadatas"]]
+            vector_store.get_session_collection(session_id).update(ids=existing["ids"], metadatas=metadatas)
+        entry["source"] = new_source
+        print(f"✏️ {old_source} renamed to {new_source}: reused {len(entry['chunk_ids'])} chunks")
+    return removed
+
+def retire_replaced_versions(db, directory_path: str, manifest: dict, replaced: Dict[str, dict], filename: str):
+    """
+    Deletes the chunks of the previous version(s) of `filename` once the new version is
+    stored and checkpointed. If its re-ingestion fails, the old chunks keep serving.
+    """
+    for file_hash, entry in list(replaced.items()):
+        if entry["source"] != filename:
+            continue
+        with vector_store.write_lock:
+            if entry["chunk_ids"]:
+                db.delete(ids=entry["chunk_ids"])
+        manifest["files"].pop(file_hash, None)
+        del replaced[file_hash]
+        if entry["chunk_ids"]:
+            lexical_index.update_index(directory_path, remove_ids=entry["chunk_ids"])
+        save_manifest(directory_path, manifest)
+        print(f"🗑️ Removed {len(entry['chunk_ids'])} chunks of the previous version of {filename}")
+
+def backfill_lexical_index(db, directory_path: str, manifest: dict):
+    """Builds the BM25 index from Chroma for sessions ingested before it existed."""
+    chunk_ids = [cid for entry in manifest["files"].values() for cid in entry["chunk_ids"]]
+    if not chunk_ids:
+        return
+    documents = []
+    for i in range(0, len(chunk_ids), UPSERT_BATCH_SIZE):
+        results = db.get(ids=chunk_ids[i : i + UPSERT_BATCH_SIZE], include=["documents"])
+        documents.extend(Document(id=cid, page_content=text or "") for cid, text in zip(results["ids"], results["documents"]))
+    lexical_index.update_index(directory_path, documents)
+    print(f"🔤 Backfilled lexical index with {len(documents)} chunks")
 
 # --- MAIN INGESTION ENTRY POINT ---
 
-def ingest_directory(directory_path: str):
-    """Function called by your FastAPI backend."""
-    # 1. Process all files in the directory into chunks
-    processed_docs = process_files_to_docs(directory_path)
-    
-    # 2. Store them in the vector database
-    if processed_docs:
-        create_vector_store(processed_docs)
-        print(f"Successfully ingested session: {os.path.basename(directory_path)}")
+def ingest_directory(directory_path: str, max_workers: Optional[int] = None, progress: Callable = _no_progress):
+    """
+    Function called by your FastAPI backend (through the ingestion_jobs scheduler).
+    progress(stage, **info) receives the current stage and file counters.
+    """
+    session_id = os.path.basename(directory_path)
+
+    # 1. Diff the directory against the content-hash manifest
+    progress("planning")
+    current_files = {
+        f: file_sha256(os.path.join(directory_path, f))
+        for f in sorted(os.listdir(directory_path)) if f.lower().endswith(".pdf")
+    }
+    manifest = load_manifest(directory_path)
+    if manifest is None:
+        manifest = adopt_legacy_chunks(vector_store.get_session_store(session_id), session_id, current_files)
+    plan = plan_ingestion(manifest, current_files)
+    for filename in plan["unchanged"]:
+        print(f"⏭️ Skipping {filename}: Already fully ingested in this session.")
+
+    # 2. Drop chunks of deleted files, relabel renamed ones. The old version of an edited file
+    #    (same name, new content) stays until its replacement has been stored and checkpointed.
+    replaced = {h: manifest["files"][h] for h in plan["stale"] if manifest["files"][h]["source"] in plan["ingest"]}
+    cleanup = {**plan, "stale": [h for h in plan["stale"] if h not in replaced]}
+    if cleanup["stale"] or cleanup["renamed"]:
+        progress("cleanup")
+        with vector_store.write_lock:
+            removed = apply_manifest_plan(vector_store.get_session_store(session_id), cleanup, manifest, session_id)
+        if removed:
+            lexical_index.update_index(directory_path, remove_ids=removed)
+    update_aliases(manifest, current_files)
+    if not lexical_index.index_exists(directory_path):
+        backfill_lexical_index(vector_store.get_session_store(session_id), directory_path, manifest)
+
+    save_manifest(directory_path, manifest)
+
+    # 3. Stream new or changed files: each file is embedded, upserted and checkpointed
+    #    in the manifest as soon as it is done, so a crash only loses the file in flight.
+    db = vector_store.get_session_store(session_id)
+    stored = 0
+    page_totals = {"hi_res_pages": 0, "fast_pages": 0}
+    files_done = 0
+    progress(files_total=len(plan["ingest"]), files_done=0)
+    for filename, file_hash, docs, stats in iter_file_documents(directory_path, max_workers=max_workers,
+                                                                file_hashes=plan["ingest"], progress=progress):
+        if docs:
+            progress("storing", current_file=filename)
+            upsert_documents(db, docs)
+            lexical_index.update_index(directory_path, docs)
+            stored += len(docs)
+        for key in page_totals:
+            page_totals[key] += stats.get(key, 0)
+        if docs:
+            record_file(manifest, file_hash, filename, [doc.id for doc in docs], partition_stats=stats)
+        else:
+            # Failed or empty files are not checkpointed, so the next run tries them again
+            manifest["files"].pop(file_hash, None)
+            print(f"⚠️ {filename} produced no chunks ({stats.get('error', 'nothing extracted')}); will retry on next ingestion")
+        update_aliases(manifest, current_files)
+        save_manifest(directory_path, manifest)
+        if docs or not stats.get("error"):
+            retire_replaced_versions(db, directory_path, manifest, replaced, filename)
+        files_done += 1
+        progress(files_done=files_done)
+        del docs
+
+    if plan["ingest"]:
+        print(f"📊 Partitioned pages: {page_totals['hi_res_pages']} hi_res / {page_totals['fast_pages']} fast")
+    if stored:
+        print(f"Successfully ingested session: {session_id} ({stored} new chunks)")
     else:
-        print("No valid documents found for ingestion.")
+        print("No new documents found for ingestion.")
 
 if __name__ == "__main__":
     # Standard test logic for standalone execution
@@ -0,0 +1,156 @@
+import os
+import re
+import json
+import math
+import heapq
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+from file_utils import atomic_write_json
+
+# --- CONFIG ---
+# Per-session BM25 inverted index over the same text that is embedded in Chroma, kept next
+# to the ingestion manifest and updated incrementally as files are added or removed.
+# It catches exact terms the MiniLM embeddings blur: equation names, acronyms, "28.4 BLEU".
+LEXICAL_INDEX_NAME = "lexical_index.json"
+LEXICAL_INDEX_VERSION = 1
+UPLOAD_ROOT = "uploads"
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60   # Reciprocal rank fusion constant (Cormack et al.)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-_][a-z0-9]+)*")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "in", "is", "it", "its",
+    "of", "on", "or", "that", "the", "this", "to", "was", "were", "which", "with", "what", "how",
+    "why", "does", "do", "can", "explain", "topic", "summary", "original", "text",
+}
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms; compounds like "self-attention" or "28.4" also index their parts."""
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token not in STOPWORDS:
+            terms.append(token)
+        if any(sep in token for sep in ".-_"):
+            terms.extend(part for part in re.split(r"[.\-_]", token) if part and part not in STOPWORDS)
+    return terms
+
+class LexicalIndex:
+    """BM25 over one session's chunks. `docs` (chunk id -> term frequencies) is what gets persisted."""
+
+    def __init__(self, docs: Optional[Dict[str, Dict[str, int]]] = None):
+        self.docs = {}
+        self.lengths = {}
+        self.postings = {}
+        self.total_length = 0
+        for chunk_id, tf in (docs or {}).items():
+            self._add_tf(chunk_id, tf)
+
+    def _add_tf(self, chunk_id: str, tf: Dict[str, int]):
+        self.docs[chunk_id] = tf
+        length = sum(tf.values())
+        self.lengths[chunk_id] = length
+        self.total_length += length
+        for term, count in tf.items():
+            self.postings.setdefault(term, {})[chunk_id] = count
+
+    def add(self, chunk_id: str, text: str):
+        if chunk_id in self.docs:
+            self.remove([chunk_id])
+        self._add_tf(chunk_id, dict(Counter(tokenize(text))))
+
+    def remove(self, chunk_ids: Iterable[str]):
+        for chunk_id in chunk_ids:
+            tf = self.docs.pop(chunk_id, None)
+            if tf is None:
+                continue
+            self.total_length -= self.lengths.pop(chunk_id)
+            for term in tf:
+                posting = self.postings.get(term)
+                if posting is not None:
+                    posting.pop(chunk_id, None)
+                    if not posting:
+                        del self.postings[term]
+
+    def search(self, query: str, k: int = 8) -> List[Tuple[str, float]]:
+        """Top-k (chunk id, BM25 score) for the query terms."""
+        n = len(self.docs)
+        if not n:
+            return []
+        avgdl = self.total_length / n or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for chunk_id, tf in posting.items():
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[chunk_id] / avgdl)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def __len__(self):
+        return len(self.docs)
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Fuses ranked id lists: score(id) = sum over lists of 1 / (k + rank)."""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+# --- Persistence (one index per session directory, cached in memory) ---
+
+_lock = threading.Lock()
+_loaded: Dict[str, Tuple[object, LexicalIndex]] = {}
+
+def index_path(directory_path: str) -> str:
+    return os.path.join(directory_path, LEXICAL_INDEX_NAME)
+
+def _signature(path: str):
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+def index_exists(directory_path: str) -> bool:
+    return os.path.exists(index_path(directory_path))
+
+def load_index(directory_path: str) -> LexicalIndex:
+    """The session's index (empty if none was built yet); reloaded only when the file changes."""
+    path = index_path(directory_path)
+    signature = _signature(path)
+    with _lock:
+        cached = _loaded.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        index = LexicalIndex()
+        if signature is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == LEXICAL_INDEX_VERSION:
+                    index = LexicalIndex(data["docs"])
+            except Exception as e:
+                print(f"⚠️ Could not read lexical index {path}: {e}")
+        _loaded[path] = (signature, index)
+        return index
+
+def update_index(directory_path: str, documents: Iterable = (), remove_ids: Iterable[str] = ()):
+    """Adds LangChain Documents (by doc.id) and removes chunk ids, then saves atomically."""
+    # Copy-on-write: concurrent /ask searches keep using the previous index object
+    index = LexicalIndex(dict(load_index(directory_path).docs))
+    path = index_path(directory_path)
+    with _lock:
+        index.remove(remove_ids)
+        for doc in documents:
+            index.add(doc.id, doc.page_content)
+        atomic_write_json(path, {"version": LEXICAL_INDEX_VERSION, "docs": index.docs})
+        _loaded[path] = (_signature(path), index)
+    return index
+
+def search_session(session_id: str, query: str, k: int = 8) -> List[Tuple[str, float]]:
+    return load_index(os.path.join(UPLOAD_ROOT, session_id)).search(query, k)
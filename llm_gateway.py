@@ -0,0 +1,258 @@
+import os
+import time
+import asyncio
+import heapq
+import itertools
+import threading
+from typing import AsyncIterator, Dict, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+# --- CONFIG ---
+# One process-wide gateway for every Gemini call. Requests wait for both an RPM and a
+# TPM token bucket, in priority order, so interactive traffic overtakes background work.
+# GEMINI_MODEL = "gemini-2.5-flash"  # Use for high-quality showcase
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")  # Use for cost-effective testing
+LLM_RPM = int(os.getenv("LLM_RPM", "2000"))       # Tier 1 limits
+LLM_TPM = int(os.getenv("LLM_TPM", "1000000"))
+LLM_MAX_CONCURRENT = int(os.getenv("LLM_MAX_CONCURRENT", "8"))
+DEFAULT_OUTPUT_TOKENS = 1024   # Reserved for the answer until the real usage is known
+IMAGE_TOKENS = 258             # Gemini's flat cost per image
+CHARS_PER_TOKEN = 4
+ASYNC_POLL_SECONDS = 0.02      # Re-check interval for async waiters blocked behind others
+
+PRIORITY_INTERACTIVE = 0   # /ask and other student-facing requests
+PRIORITY_DEFAULT = 1       # On-demand generation (flashcards, assessments)
+PRIORITY_BACKGROUND = 2    # Ingestion summaries, pre-generation
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_DEFAULT: "default", PRIORITY_BACKGROUND: "background"}
+
+def estimate_tokens(messages, output_tokens: int = DEFAULT_OUTPUT_TOKENS) -> int:
+    """Rough token count for a list of LangChain messages (text parts + flat cost per image)."""
+    chars = 0
+    images = 0
+    for message in messages:
+        content = getattr(message, "content", message)
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content:
+            if isinstance(part, str):
+                chars += len(part)
+            elif part.get("type") == "image_url":
+                images += 1
+            else:
+                chars += len(part.get("text", ""))
+    return chars // CHARS_PER_TOKEN + images * IMAGE_TOKENS + output_tokens
+
+class TokenBucket:
+    """Continuously refilling bucket holding up to one minute's worth of capacity."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` tokens are available (0 if they already are)."""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def consume(self, amount: float):
+        # May go negative when actual usage exceeds the estimate; later callers then wait longer
+        self.tokens -= amount
+
+class LLMGateway:
+    def __init__(self, rpm: int = LLM_RPM, tpm: int = LLM_TPM, max_concurrent: int = LLM_MAX_CONCURRENT):
+        self.rpm = TokenBucket(rpm)
+        self.tpm = TokenBucket(tpm)
+        self.max_concurrent = max_concurrent
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self._active = 0
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        self._stats = {
+            name: {"requests": 0, "failures": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0,
+                   "estimated_tokens": 0, "actual_tokens": 0, "cancelled": 0}
+            for name in PRIORITY_NAMES.values()
+        }
+        self._max_queue_depth = 0
+
+    def get_client(self, temperature: float = 0, model: Optional[str] = None):
+        """Shared ChatGoogleGenerativeAI client per (model, temperature), created on first use."""
+        key = (model or GEMINI_MODEL, temperature)
+        with self._clients_lock:
+            if key not in self._clients:
+                from langchain_google_genai import ChatGoogleGenerativeAI
+                self._clients[key] = ChatGoogleGenerativeAI(model=key[0], temperature=temperature)
+            return self._clients[key]
+
+    def _try_take(self, ticket, tokens: int) -> float:
+        """
+        Called with the lock held. Takes capacity for `ticket` if it is at the head of the
+        queue and both buckets allow it (returns 0). Otherwise returns how long to wait:
+        the bucket refill time, or -1 to wait for another request to leave the queue.
+        """
+        if self._queue[0] != ticket or self._active >= self.max_concurrent:
+            return -1
+        now = time.monotonic()
+        wait = max(self.rpm.wait_time(1, now), self.tpm.wait_time(tokens, now))
+        if wait > 0:
+            return wait
+        heapq.heappop(self._queue)
+        self.rpm.consume(1)
+        self.tpm.consume(min(tokens, self.tpm.capacity))
+        self._active += 1
+        self._cond.notify_all()
+        return 0
+
+    def acquire(self, tokens: int, priority: int = PRIORITY_DEFAULT) -> float:
+        """Blocks until this request may run; returns the seconds spent waiting."""
+        ticket = (priority, next(self._seq))
+        start = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            self._max_queue_depth = max(self._max_queue_depth, len(self._queue))
+            while True:
+                wait = self._try_take(ticket, tokens)
+                if wait == 0:
+                    break
+                self._cond.wait(timeout=None if wait < 0 else wait)
+        return time.monotonic() - start
+
+    async def aacquire(self, tokens: int, priority: int = PRIORITY_DEFAULT) -> float:
+        """acquire() for the event loop: polls with asyncio.sleep instead of blocking a thread."""
+        ticket = (priority, next(self._seq))
+        start = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            self._max_queue_depth = max(self._max_queue_depth, len(self._queue))
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_take(ticket, tokens)
+                if wait == 0:
+                    return time.monotonic() - start
+                await asyncio.sleep(ASYNC_POLL_SECONDS if wait < 0 else min(wait, 1.0))
+        except asyncio.CancelledError:
+            with self._cond:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                    heapq.heapify(self._queue)
+                    self._cond.notify_all()
+            raise
+
+    def release(self, estimated_tokens: int, actual_tokens: Optional[int] = None):
+        with self._cond:
+            if actual_tokens is not None:
+                self.tpm.consume(actual_tokens - min(estimated_tokens, self.tpm.capacity))
+            self._active -= 1
+            self._cond.notify_all()
+
+    def _record(self, priority: int, waited: float, estimated: int, actual: Optional[int], failed: bool,
+                cancelled: bool = False):
+        with self._cond:
+            stats = self._stats[PRIORITY_NAMES.get(priority, "default")]
+            stats["requests"] += 1
+            stats["failures"] += int(failed and not cancelled)
+            stats["cancelled"] += int(cancelled)
+            stats["wait_seconds_total"] += waited
+            stats["wait_seconds_max"] = max(stats["wait_seconds_max"], waited)
+            stats["estimated_tokens"] += estimated
+            stats["actual_tokens"] += actual or 0
+
+    def invoke(self, messages: List, temperature: float = 0, priority: int = PRIORITY_DEFAULT,
+               model: Optional[str] = None, output_tokens: int = DEFAULT_OUTPUT_TOKENS):
+        """Rate-limited llm.invoke. Exceptions (e.g. 429s) propagate to the caller's retry policy."""
+        estimated = estimate_tokens(messages, output_tokens)
+        waited = self.acquire(estimated, priority)
+        actual = None
+        failed = True
+        try:
+            response = self.get_client(temperature, model).invoke(messages)
+            actual = (getattr(response, "usage_metadata", None) or {}).get("total_tokens")
+            failed = False
+            return response
+        finally:
+            self.release(estimated, actual)
+            self._record(priority, waited, estimated, actual, failed)
+
+    async def ainvoke(self, messages: List, temperature: float = 0, priority: int = PRIORITY_DEFAULT,
+                      model: Optional[str] = None, output_tokens: int = DEFAULT_OUTPUT_TOKENS):
+        """Async invoke(): waits for capacity and for Gemini without blocking the event loop."""
+        estimated = estimate_tokens(messages, output_tokens)
+        waited = await self.aacquire(estimated, priority)
+        actual = None
+        failed = True
+        try:
+            response = await self.get_client(temperature, model).ainvoke(messages)
+            actual = (getattr(response, "usage_metadata", None) or {}).get("total_tokens")
+            failed = False
+            return response
+        finally:
+            self.release(estimated, actual)
+            self._record(priority, waited, estimated, actual, failed)
+
+    async def astream(self, messages: List, temperature: float = 0, priority: int = PRIORITY_DEFAULT,
+                      model: Optional[str] = None, output_tokens: int = DEFAULT_OUTPUT_TOKENS) -> AsyncIterator:
+        """
+        Streaming ainvoke(): yields message chunks as Gemini produces them. The capacity slot
+        is held until the stream ends; closing the generator early (client gone) releases it.
+        """
+        estimated = estimate_tokens(messages, output_tokens)
+        waited = await self.aacquire(estimated, priority)
+        actual = None
+        failed = True
+        cancelled = False
+        try:
+            async for chunk in self.get_client(temperature, model).astream(messages):
+                usage = getattr(chunk, "usage_metadata", None)
+                if usage and usage.get("total_tokens"):
+                    actual = max(actual or 0, usage["total_tokens"])
+                yield chunk
+            failed = False
+        except (GeneratorExit, asyncio.CancelledError):
+            cancelled = True
+            raise
+        finally:
+            self.release(estimated, actual)
+            self._record(priority, waited, estimated, actual, failed, cancelled)
+
+    def get_stats(self) -> Dict:
+        with self._cond:
+            now = time.monotonic()
+            self.rpm._refill(now)
+            self.tpm._refill(now)
+            return {
+                "queue_depth": len(self._queue),
+                "max_queue_depth": self._max_queue_depth,
+                "active_requests": self._active,
+                "rpm_available": int(self.rpm.tokens),
+                "tpm_available": int(self.tpm.tokens),
+                "by_priority": {
+                    name: {**s, "avg_wait_seconds": s["wait_seconds_total"] / s["requests"] if s["requests"] else 0.0}
+                    for name, s in self._stats.items()
+                }
+            }
+
+gateway = LLMGateway()
+
+def invoke(messages: List, temperature: float = 0, priority: int = PRIORITY_DEFAULT, **kwargs):
+    return gateway.invoke(messages, temperature=temperature, priority=priority, **kwargs)
+
+async def ainvoke(messages: List, temperature: float = 0, priority: int = PRIORITY_DEFAULT, **kwargs):
+    return await gateway.ainvoke(messages, temperature=temperature, priority=priority, **kwargs)
+
+def astream(messages: List, temperature: float = 0, priority: int = PRIORITY_DEFAULT, **kwargs) -> AsyncIterator:
+    return gateway.astream(messages, temperature=temperature, priority=priority, **kwargs)
+
+def get_stats() -> Dict:
+    return gateway.get_stats()
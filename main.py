@@ -1,18 +1,25 @@
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks, HTTPException, Form
-from typing import List
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
 import os
 import shutil
 import uuid
 import json # Added json import as it's used later in the code
 
-from ingestion_pipeline import ingest_directory
-from retrieval_service import get_doubt_assistant_response
+import ingestion_jobs
+from retrieval_service import aget_doubt_assistant_response, astream_doubt_assistant_response, get_chunk_assets
 
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
+import answer_cache
 import assessment_service
+import classroom_admin
 import flashcard_service
+import llm_gateway
+import session_vector_index
+import vector_store
+from async_utils import run_blocking
 
 app = FastAPI()
 
@@ -35,6 +42,23 @@ os.makedirs(UPLOAD_ROOT, exist_ok=True)
 
 app.mount("/uploads", StaticFiles(directory=UPLOAD_ROOT), name="uploads")
 
+# FAST_BOOT=1 skips the startup warm-up: the embedding model and Chroma load on first use
+FAST_BOOT = os.getenv("FAST_BOOT", "0") == "1"
+
+@app.on_event("startup")
+async def warm_up_vector_store():
+    # Load the embedding model and open Chroma off the request path; /ready reports when done
+    if not FAST_BOOT:
+        vector_store.start_warm_up()
+
+@app.on_event("startup")
+async def resume_ingestion_jobs():
+    # Pre-generation runs after every successful ingestion; registered before recovery
+    ingestion_jobs.on_complete(flashcard_service.prewarm_flashcards)
+    ingestion_jobs.on_complete(assessment_service.pregenerate_assessments)
+    # Jobs interrupted by a restart are picked up again
+    ingestion_jobs.scheduler.recover()
+
 # ----------------------------
 # HELPERS
 # ----------------------------
@@ -58,7 +82,35 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "study-assistant-ingestion"}
+    return {"status": "healthy", "service": "study-assistant-ingestion", "ready": vector_store.is_ready(),
+            "fast_boot": FAST_BOOT}
+
+@app.get("/ready")
+async def readiness_check():
+    """
+    503 until the embedding model and vector store have been warmed up. With FAST_BOOT they
+    load on first use, so the instance is ready right away and `loaded` reports the warm state.
+    """
+    if FAST_BOOT:
+        return {"status": "ready", "loaded": vector_store.is_ready()}
+    if not vector_store.is_ready():
+        raise HTTPException(status_code=503, detail="Warming up")
+    return {"status": "ready"}
+
+@app.get("/api/llm/stats")
+async def llm_stats():
+    """Queue depth, wait times and token usage of the shared LLM gateway."""
+    return llm_gateway.get_stats()
+
+@app.get("/api/answer_cache/stats")
+async def answer_cache_stats():
+    """Hit/miss counters and size of the Doubt Assistant's semantic answer cache."""
+    return answer_cache.get_stats()
+
+@app.get("/api/session_index/stats")
+async def session_index_stats():
+    """Sessions held in the in-memory vector index, their size and load/hit counters."""
+    return session_vector_index.get_stats()
 
 # ----------------------------
 # DOUBT ASSISTANT ENDPOINT
@@ -71,11 +123,52 @@ async def ask_question(session_id: str, query: str, language: str = "english"):
     Endpoint for the Student Portal Doubt Assistant.
     """
     try:
-        response = get_doubt_assistant_response(query, session_id, language)
+        response = await aget_doubt_assistant_response(query, session_id, language)
         return {"response": response}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def format_sse(event: str, data) -> str:
+    # Tokens are JSON-encoded so newlines inside the answer survive the SSE framing
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.get("/ask/stream")
+async def ask_question_stream(request: Request, session_id: str, query: str, language: str = "english"):
+    """
+    Streaming Doubt Assistant over Server-Sent Events (usable from EventSource).
+    Sends a `metadata` event with the retrieved sources, `token` events as the answer is
+    generated, then `done` (or `error`). Generation stops when the client disconnects.
+    """
+    print(f"📥 /ask/stream Request - Session: {session_id}, Query: {query}, Lang: {language}")
+
+    async def event_stream():
+        stream = astream_doubt_assistant_response(query, session_id, language)
+        try:
+            async for event, data in stream:
+                if await request.is_disconnected():
+                    print(f"🔌 Client disconnected, stopping stream for session {session_id}")
+                    break
+                yield format_sse(event, data)
+        except Exception as e:
+            yield format_sse("error", {"detail": str(e)})
+        finally:
+            # Closing the generator cancels the Gemini stream and frees its gateway slot
+            await stream.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/chunks/{chunk_id}/assets")
+async def get_chunk_assets_endpoint(chunk_id: str, session_id: Optional[str] = None):
+    """Fetch the tables and images of a retrieved chunk on demand."""
+    assets = await run_blocking(get_chunk_assets, chunk_id, session_id)
+    if assets is None:
+        raise HTTPException(status_code=404, detail="Chunk not found")
+    return assets
+
 # ----------------------------
 # UPLOAD ENDPOINT
 # ----------------------------
@@ -83,8 +176,7 @@ async def ask_question(session_id: str, query: str, language: str = "english"):
 @app.post("/upload")
 async def upload_files(
     files: List[UploadFile] = File(...),
-    session_id: str = Form("default"),
-    background_tasks: BackgroundTasks = BackgroundTasks()
+    session_id: str = Form("default")
 ):
     if not files:
         raise HTTPException(status_code=400, detail="No files uploaded")
@@ -122,9 +214,9 @@ async def upload_files(
             detail="No valid PDF files were uploaded"
         )
 
-    # Trigger ingestion in background
+    # Queue ingestion in background (merged with any pending job for this session)
     try:
-        background_tasks.add_task(ingest_directory, session_dir)
+        job = ingestion_jobs.submit(session_dir)
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -135,9 +227,18 @@ async def upload_files(
         "session_id": session_id,
         "status": "processing",
         "uploaded_files": saved_files,
-        "rejected_files": rejected_files
+        "rejected_files": rejected_files,
+        "ingestion": job
     }
 
+@app.get("/api/ingest/status/{session_id}")
+async def get_ingestion_status(session_id: str):
+    """Current stage, file progress and per-stage timings of a session's ingestion job."""
+    status = ingestion_jobs.get_status(session_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="No ingestion job for this session")
+    return status
+
 # ----------------------------
 # ASSESSMENT ENDPOINTS
 # ----------------------------
@@ -166,11 +267,37 @@ async def get_classrooms():
             classrooms.append(name)
     return {"classrooms": classrooms}
 
+async def run_classroom_admin(fn, session_id: str):
+    # Maps classroom_admin errors: bad id -> 400, missing -> 404, ingestion running -> 409
+    try:
+        return await run_blocking(fn, session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.delete("/api/classrooms/{session_id}")
+async def delete_classroom_endpoint(session_id: str):
+    """Delete a classroom: its vector collection, uploaded files and any archive."""
+    return await run_classroom_admin(classroom_admin.delete_classroom, session_id)
+
+@app.post("/api/classrooms/{session_id}/archive")
+async def archive_classroom_endpoint(session_id: str):
+    """Move a classroom's vectors out of Chroma into the archive (uploads are kept)."""
+    return await run_classroom_admin(classroom_admin.archive_classroom, session_id)
+
+@app.post("/api/classrooms/{session_id}/restore")
+async def restore_classroom_endpoint(session_id: str):
+    """Bring an archived classroom back into Chroma."""
+    return await run_classroom_admin(classroom_admin.restore_classroom, session_id)
+
 @app.post("/api/assessment/generate")
 async def generate_assessment_endpoint(request: AssessmentRequest):
     """Generate or retrieve an assessment for a specific level."""
-    from assessment_service import generate_assessment
-    result = generate_assessment(request.session_id, request.level)
+    from assessment_service import agenerate_assessment
+    result = await agenerate_assessment(request.session_id, request.level)
     if "error" in result:
         raise HTTPException(status_code=500, detail=result["error"])
     return result
@@ -178,8 +305,8 @@ async def generate_assessment_endpoint(request: AssessmentRequest):
 @app.post("/api/assessment/submit")
 async def submit_assessment_endpoint(request: SubmitRequest):
     """Submit results and calculate XP/Unlocks."""
-    from assessment_service import submit_assessment_result
-    result = submit_assessment_result(
+    from assessment_service import asubmit_assessment_result
+    result = await asubmit_assessment_result(
         request.session_id, 
         request.level, 
         request.score, 
@@ -218,7 +345,7 @@ async def get_progress_endpoint(session_id: str):
 async def get_flashcards(session_id: str, language: str = "english"):
     """Get topic-wise revision flashcards with language support."""
     try:
-        cards = flashcard_service.generate_flashcards(session_id, language)
+        cards = await flashcard_service.agenerate_flashcards(session_id, language)
         return cards
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -269,8 +396,38 @@ async def get_teacher_analytics_endpoint(session_id: str):
 @app.get("/api/teacher/assessments/{session_id}")
 async def get_teacher_assessments_endpoint(session_id: str):
     """Get all assessments organized by chapter and quest level for teacher preview."""
-    from assessment_service import get_all_assessments_for_teacher
-    return get_all_assessments_for_teacher(session_id)
+    return await assessment_service.aget_all_assessments_for_teacher(session_id)
+
+@app.get("/api/teacher/assessments/{session_id}/stream")
+async def stream_teacher_assessments_endpoint(request: Request, session_id: str):
+    """
+    Teacher preview over Server-Sent Events: a `chapters` event with the chapter list, one
+    `assessment` event per (chapter, level) as soon as it is ready (stored ones first), then `done`.
+    """
+    files = await run_blocking(assessment_service.get_sorted_files, session_id)
+
+    async def event_stream():
+        yield format_sse("chapters", {"chapters": [f["filename"] for f in files],
+                                      "total": len(files) * len(assessment_service.ASSESSMENT_LEVELS)})
+        counts = {"cached": 0, "generated": 0, "failed": 0}
+        entries = assessment_service.aiter_teacher_assessments(session_id, files)
+        try:
+            async for entry in entries:
+                if await request.is_disconnected():
+                    break
+                failed = "error" in entry["assessment"]
+                counts["failed" if failed else "cached" if entry["cached"] else "generated"] += 1
+                yield format_sse("assessment", entry)
+            else:
+                yield format_sse("done", counts)
+        finally:
+            await entries.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # ----------------------------
 # TEACHER REVIEW ENDPOINT
@@ -293,13 +450,14 @@ async def save_teacher_review(data: dict):
     try:
         with open(review_path, "w") as f:
             json.dump(data, f, indent=4)
+        # New guidance changes how answers are phrased
+        answer_cache.invalidate_session(session_id)
         return {"status": "success", "message": "Teacher review saved"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/upload_review")
 async def upload_review(
-    background_tasks: BackgroundTasks,
     session_id: str = Form(...),
     assessment_focus: str = Form(""),
     student_gaps: str = Form(""),
@@ -329,7 +487,7 @@ async def upload_review(
             review_data["document_path"] = file_path
             
             # Trigger ingestion for RAG
-            background_tasks.add_task(ingest_directory, session_dir)
+            ingestion_jobs.submit(session_dir)
             
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to save review document: {str(e)}")
@@ -338,6 +496,7 @@ async def upload_review(
     try:
         with open(review_path, "w") as f:
             json.dump(review_data, f, indent=4)
+        answer_cache.invalidate_session(session_id)
         return {"status": "success", "message": "Teacher review saved and processing started"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,55 @@
+"""
+Moves existing chroma_db data from the shared collection into one collection per classroom.
+
+Stored embeddings are copied as-is (nothing is re-embedded). Sessions are also migrated
+lazily on first use when VECTOR_LAYOUT=per_session, so running this is optional, but it
+avoids the first-query delay and lets the shared collection be dropped.
+
+    python migrate_collections.py --dry-run
+    python migrate_collections.py                 # move every session, then drop the shared collection if empty
+    python migrate_collections.py --keep-source   # copy only, leave the shared collection untouched
+"""
+import argparse
+from collections import Counter
+
+import vector_store
+
+def scan_sessions(collection) -> Counter:
+    counts = Counter()
+    for page in vector_store._batched_get(collection, include=("metadatas",)):
+        counts.update((metadata or {}).get("session_id") for metadata in page["metadatas"])
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=vector_store.COLLECTION_NAME, help="shared collection to split")
+    parser.add_argument("--dry-run", action="store_true", help="only report chunk counts per session")
+    parser.add_argument("--keep-source", action="store_true", help="do not delete migrated chunks from the source")
+    args = parser.parse_args()
+
+    if args.source not in vector_store.list_collection_names():
+        print(f"Nothing to migrate: collection {args.source} does not exist.")
+        return
+
+    source = vector_store.get_client().get_collection(args.source)
+    counts = scan_sessions(source)
+    orphans = counts.pop(None, 0)
+    print(f"📊 {sum(counts.values())} chunks in {len(counts)} sessions" + (f", {orphans} without a session_id" if orphans else ""))
+    for session_id, count in counts.most_common():
+        print(f"   {session_id}: {count} chunks -> {vector_store.session_collection_name(session_id)}")
+    if args.dry_run:
+        return
+
+    for session_id in counts:
+        vector_store.migrate_session(session_id, source_collection=args.source, delete_source=not args.keep_source)
+
+    if not args.keep_source:
+        remaining = source.count()
+        if remaining == 0:
+            vector_store.get_client().delete_collection(args.source)
+            print(f"🗑️ Dropped empty collection {args.source}")
+        else:
+            print(f"⚠️ {remaining} chunks without a session_id left in {args.source}")
+
+if __name__ == "__main__":
+    main()
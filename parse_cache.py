@@ -0,0 +1,126 @@
+import os
+import gzip
+import json
+import tempfile
+import threading
+from typing import Callable, List, Optional, Sequence
+from file_utils import atomic_write_json, file_sha256_cached
+
+# Parsed `unstructured` elements, shared by ingestion and assessment generation.
+# Keyed by file content hash + partition strategy and stored as gzipped element JSON,
+# so each file is partitioned at most once per strategy.
+PARSE_CACHE_DIR = os.path.join("data", "parse_cache")
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+def _content_hash(file_path: str) -> str:
+    return file_sha256_cached(file_path)
+
+def _cache_path(file_hash: str, strategy: str) -> str:
+    return os.path.join(PARSE_CACHE_DIR, f"{file_hash}_{strategy}.json.gz")
+
+def _key_lock(key: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(key, threading.Lock())
+
+def load_cached_elements(file_path: str, strategy: str) -> Optional[List]:
+    """Returns the cached elements for this file and strategy, or None on a miss."""
+    path = _cache_path(_content_hash(file_path), strategy)
+    if not os.path.exists(path):
+        return None
+    try:
+        from unstructured.staging.base import elements_from_json
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return elements_from_json(text=f.read())
+    except Exception as e:
+        print(f"⚠️ Ignoring unreadable parse cache {path}: {e}")
+        return None
+
+def _info_path(file_hash: str, strategy: str) -> str:
+    return os.path.join(PARSE_CACHE_DIR, f"{file_hash}_{strategy}.info.json")
+
+def load_cache_info(file_path: str, strategy: str) -> dict:
+    """Returns the side information (e.g. page triage stats) stored with a cached parse."""
+    try:
+        with open(_info_path(_content_hash(file_path), strategy), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def store_elements(file_path: str, strategy: str, elements: List, info: Optional[dict] = None):
+    from unstructured.staging.base import elements_to_json
+    file_hash = _content_hash(file_path)
+    path = _cache_path(file_hash, strategy)
+    os.makedirs(PARSE_CACHE_DIR, exist_ok=True)
+    # Both files are renamed into place; the info goes first so a visible parse always has it.
+    # mkstemp names are unique across forked workers (thread idents are not).
+    if info:
+        atomic_write_json(_info_path(file_hash, strategy), info)
+    fd, tmp_path = tempfile.mkstemp(dir=PARSE_CACHE_DIR, prefix=".tmp_", suffix=".json.gz")
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+            f.write(elements_to_json(elements))
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def remove_entries(file_hash: str) -> int:
+    """Deletes every cached parse (all strategies, with side info) of one content hash."""
+    removed = 0
+    if not os.path.isdir(PARSE_CACHE_DIR):
+        return 0
+    for name in os.listdir(PARSE_CACHE_DIR):
+        if name.startswith(f"{file_hash}_") and (name.endswith(".json.gz") or name.endswith(".info.json")):
+            try:
+                os.remove(os.path.join(PARSE_CACHE_DIR, name))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+def partition_cached(file_path: str, strategy: str, partition_fn: Optional[Callable] = None,
+                     **partition_kwargs) -> List:
+    """
+    partition_pdf through the cache. Concurrent callers for the same file and strategy
+    wait for one parse instead of repeating it. Failures are raised and not cached.
+
+    partition_fn(file_path, **partition_kwargs) -> (elements, info) replaces partition_pdf
+    for composite strategies such as "adaptive"; its info dict is cached alongside. A
+    result whose info has "degraded" set (a partial fallback) is returned but not cached.
+    """
+    key = f"{_content_hash(file_path)}_{strategy}"
+    with _key_lock(key):
+        elements = load_cached_elements(file_path, strategy)
+        if elements is not None:
+            print(f"♻️ Parse cache hit ({strategy}): {os.path.basename(file_path)}")
+            return elements
+
+        if partition_fn is None:
+            from unstructured.partition.pdf import partition_pdf
+            elements = partition_pdf(filename=file_path, strategy=strategy, **partition_kwargs)
+            info = None
+        else:
+            elements, info = partition_fn(file_path, **partition_kwargs)
+        if info and info.get("degraded"):
+            print(f"⚠️ Not caching degraded {strategy} parse of {os.path.basename(file_path)}")
+            return elements
+        try:
+            store_elements(file_path, strategy, elements, info)
+        except Exception as e:
+            print(f"⚠️ Failed to write parse cache for {file_path}: {e}")
+        return elements
+
+def get_document_elements(file_path: str, preferred: Sequence[str] = ("adaptive", "hi_res", "fast")) -> List:
+    """
+    Returns elements from the best strategy already cached for this file (e.g. the
+    adaptive/hi_res parse written by ingestion); only parses, with the last strategy,
+    if none is cached.
+    """
+    for strategy in preferred:
+        elements = load_cached_elements(file_path, strategy)
+        if elements is not None:
+            return elements
+    return partition_cached(file_path, preferred[-1])
@@ -1,10 +1,6 @@
 import os
 import json
-from typing import List, Dict
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_core.messages import HumanMessage, SystemMessage
+from typing import List, Dict, Optional
 from tenacity import (
     retry,
     stop_after_attempt,
@@ -12,14 +8,24 @@ from tenacity import (
     retry_if_exception_type
 )
 from dotenv import load_dotenv
+from blob_store import load_chunk_assets
+import answer_cache
+import context_packing
+import lexical_index
+import llm_gateway
+import session_vector_index
+import vector_store
+from async_utils import run_blocking, SingleFlight
 
 load_dotenv(override=True)
 
 # --- CONFIG ---
-CHROMA_PATH = "./chroma_db"
-LOCAL_EMBEDDINGS = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
 # Temperature set to 0.2 for creative analogies while staying grounded
-llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.2)
+LLM_TEMPERATURE = 0.2
+RETRIEVAL_K = 8
+# Fuse dense MMR results with the session's BM25 index (reciprocal rank fusion)
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "1") == "1"
+LEXICAL_K = 8
 
 @retry(
     stop=stop_after_attempt(5),
@@ -29,12 +35,34 @@ llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.2)
 )
 def generate_ai_response(messages):
     try:
-        return llm.invoke(messages)
+        # Student-facing: jumps ahead of background ingestion in the shared gateway
+        return llm_gateway.invoke(messages, temperature=LLM_TEMPERATURE, priority=llm_gateway.PRIORITY_INTERACTIVE)
     except Exception as e:
         print(f"DEBUG: API call failed with error: {str(e)}")
         # If it's a 429, we want to know the EXACT message (e.g., TPM, RPM, or Account limit)
         raise e
 
+@retry(
+    stop=stop_after_attempt(5),
+    wait=wait_exponential(multiplier=1, min=2, max=10),
+    retry=retry_if_exception_type(Exception),
+    before_sleep=lambda retry_state: print(f"⚠️ API Limit hit (Retrieval). Retrying in {retry_state.next_action.sleep} seconds...")
+)
+async def agenerate_ai_response(messages):
+    try:
+        return await llm_gateway.ainvoke(messages, temperature=LLM_TEMPERATURE, priority=llm_gateway.PRIORITY_INTERACTIVE)
+    except Exception as e:
+        print(f"DEBUG: API call failed with error: {str(e)}")
+        raise e
+
+# Identical questions asked at the same moment share one retrieval + Gemini call
+_ask_flights = SingleFlight("ask")
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+NO_RESULTS_MESSAGE = "I'm sorry, I couldn't find any information related to that in your uploaded documents. Could you try rephrasing or asking about a different topic?"
+
 SYSTEM_PROMPT = """
 You are a friendly, expert Study Assistant Bot. Your goal is to help students understand complex topics from their teacher's uploaded materials.
 
@@ -55,33 +83,73 @@ Rules for your response:
 9. **Analogies**: Always provide at least one analogy for complex concepts.
 """
 
-def get_doubt_assistant_response(query: str, session_id: str, language: str = "english"):
+def embed_query(query: str) -> List[float]:
+    """Embeds the question once; the vector serves both the answer cache and the MMR search."""
+    return vector_store.get_embeddings().embed_query(query)
+
+def dense_search(db, query_embedding: List[float], session_id: str, k: int = RETRIEVAL_K):
+    if session_vector_index.SESSION_VECTOR_INDEX:
+        # Hot sessions are searched in memory instead of through Chroma's metadata filter
+        return session_vector_index.mmr_search(session_id, query_embedding, k=k, fetch_k=20, lambda_mult=0.5)
+    return db.max_marginal_relevance_search_by_vector(
+        query_embedding, 
+        k=k, 
+        fetch_k=20, 
+        lambda_mult=0.5, 
+        filter=vector_store.session_filter(session_id)
+    )
+
+def hybrid_search(db, query: str, query_embedding: List[float], session_id: str, k: int = RETRIEVAL_K):
+    """Dense MMR + BM25, fused with reciprocal rank fusion. Lexical-only hits are fetched by id."""
+    from langchain_core.documents import Document
+
+    dense = dense_search(db, query_embedding, session_id, k)
+    lexical = lexical_index.search_session(session_id, query, LEXICAL_K)
+    if not lexical or any(doc.id is None for doc in dense):
+        return dense
+
+    by_id = {doc.id: doc for doc in dense}
+    fused = lexical_index.reciprocal_rank_fusion([[doc.id for doc in dense], [cid for cid, _ in lexical]])[:k]
+    missing = [cid for cid, _ in fused if cid not in by_id]
+    if missing:
+        fetched = db.get(ids=missing, include=["documents", "metadatas"])
+        for cid, text, metadata in zip(fetched["ids"], fetched["documents"], fetched["metadatas"]):
+            by_id[cid] = Document(id=cid, page_content=text, metadata=metadata)
+    print(f"🔤 Hybrid retrieval: {len(dense)} dense + {len(lexical)} lexical -> {len(missing)} lexical-only chunks added")
+    return [by_id[cid] for cid, _ in fused if cid in by_id]
+
+def prepare_doubt_request(query: str, session_id: str, language: str = "english",
+                          query_embedding: Optional[List[float]] = None):
     """
-    Main retrieval pipeline for the Doubt Assistant.
+    Blocking half of the Doubt Assistant: retrieval and prompt assembly.
+    Returns (messages, retrieved documents); messages is None when nothing was found.
     """
-    # 1. Connect to DB
-    db = Chroma(
-        persist_directory=CHROMA_PATH,
-        embedding_function=LOCAL_EMBEDDINGS,
-        collection_name="hackathon_collection"
-    )
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    # 1. Connect to the classroom's collection
+    db = vector_store.get_session_store(session_id, create=False)
+    if db is None:
+        print(f"⚠️ No collection for session {session_id}")
+        return None, []
 
     # 3. Retrieve context from Vector DB
     print(f"🔍 Searching ChromaDB for session: {session_id} with query: {query}")
-    results = db.max_marginal_relevance_search(
-        query, 
-        k=8, 
-        fetch_k=20, 
-        lambda_mult=0.5, 
-        filter={"session_id": session_id}
-    )
+    if query_embedding is None:
+        query_embedding = embed_query(query)
+    if HYBRID_RETRIEVAL:
+        results = hybrid_search(db, query, query_embedding, session_id)
+    else:
+        results = dense_search(db, query_embedding, session_id)
     print(f"📊 Found {len(results)} chunks in ChromaDB")
     
+    if not results and vector_store.VECTOR_LAYOUT != "shared":
+        # Each classroom has its own collection; never answer from another classroom's material
+        return None, []
     if not results:
         # Fallback to general search if no session-specific data
         print("⚠️ No session-specific results found. Checking without filter...")
-        results = db.max_marginal_relevance_search(
-            query,
+        results = db.max_marginal_relevance_search_by_vector(
+            query_embedding,
             k=5,
             fetch_k=10,
             lambda_mult=0.5
@@ -89,12 +157,10 @@ def get_doubt_assistant_response(query: str, session_id: str, language: str = "e
         print(f"📊 Found {len(results)} chunks in Global fallback")
         
         if not results:
-            return "I'm sorry, I couldn't find any information related to that in your uploaded documents. Could you try rephrasing or asking about a different topic?"
+            return None, []
 
-    # 3. Format Context
-    context_text = ""
-    for i, doc in enumerate(results):
-        context_text += f"\n--- SOURCE CHUNK {i+1} ---\n{doc.page_content}\n"
+    # 3. Pack context into the token budget (deduplicated, grouped by topic)
+    context_text, packing = context_packing.pack_context(query, results)
 
     # 4. Multilingual Prompt logic
     lang_instruction = ""
@@ -139,9 +205,136 @@ def get_doubt_assistant_response(query: str, session_id: str, language: str = "e
         SystemMessage(content=SYSTEM_PROMPT),
         HumanMessage(content=student_prompt)
     ]
+    print(f"🧮 Context ({packing['mode']}): {packing['chunks_used']}/{packing['chunks_retrieved']} chunks in "
+          f"{packing['topics']} topics, {packing['tokens_before']} -> {packing['tokens_after']} tokens; "
+          f"request ~{llm_gateway.estimate_tokens(messages, 0)} input tokens")
+    return messages, results
 
+def get_doubt_assistant_response(query: str, session_id: str, language: str = "english"):
+    """
+    Main retrieval pipeline for the Doubt Assistant.
+    """
+    embedding = embed_query(query)
+    cached = answer_cache.lookup(session_id, language, embedding)
+    if cached:
+        print(f"⚡ Answer cache hit ({cached['similarity']:.3f}) for: {query}")
+        return cached["answer"]
+    messages, results = prepare_doubt_request(query, session_id, language, embedding)
+    if messages is None:
+        return NO_RESULTS_MESSAGE
     response = generate_ai_response(messages)
+    answer_cache.store(session_id, language, query, embedding, response.content, describe_sources(results))
     return response.content
 
+async def aget_doubt_assistant_response(query: str, session_id: str, language: str = "english"):
+    """
+    Async Doubt Assistant for request handlers: retrieval runs in the bounded blocking
+    pool and the Gemini call is awaited, so the event loop keeps serving other students.
+    Concurrent identical questions are coalesced into one computation.
+    """
+    key = (session_id, language.lower(), normalize_query(query))
+    return await _ask_flights.do(key, _aget_doubt_assistant_response, query, session_id, language)
+
+async def _aget_doubt_assistant_response(query: str, session_id: str, language: str):
+    embedding = await run_blocking(embed_query, query)
+    cached = await run_blocking(answer_cache.lookup, session_id, language, embedding)
+    if cached:
+        print(f"⚡ Answer cache hit ({cached['similarity']:.3f}) for: {query}")
+        return cached["answer"]
+    messages, results = await run_blocking(prepare_doubt_request, query, session_id, language, embedding)
+    if messages is None:
+        return NO_RESULTS_MESSAGE
+    response = await agenerate_ai_response(messages)
+    await run_blocking(answer_cache.store, session_id, language, query, embedding, response.content,
+                       describe_sources(results))
+    return response.content
+
+def describe_sources(results) -> List[Dict]:
+    """Lightweight description of the retrieved chunks, sent ahead of a streamed answer."""
+    return [
+        {
+            "chunk_id": getattr(doc, "id", None),
+            "source": doc.metadata.get("source"),
+            "parent_topic": doc.metadata.get("parent_topic"),
+        }
+        for doc in results
+    ]
+
+async def astream_doubt_assistant_response(query: str, session_id: str, language: str = "english"):
+    """
+    Streaming Doubt Assistant. Yields (event, data) pairs: one "metadata" event with the
+    retrieved sources, "token" events as Gemini generates text, then "done".
+    If the stream fails before the first token, falls back to the retried non-streaming call;
+    once tokens have been sent a failure propagates, since a partial answer cannot be replayed.
+    """
+    embedding = await run_blocking(embed_query, query)
+    cached = await run_blocking(answer_cache.lookup, session_id, language, embedding)
+    if cached:
+        print(f"⚡ Answer cache hit ({cached['similarity']:.3f}) for: {query}")
+        yield "metadata", {"session_id": session_id, "language": language, "sources": cached["sources"], "cached": True}
+        yield "token", cached["answer"]
+        yield "done", {"fallback": False, "cached": True}
+        return
+
+    messages, results = await run_blocking(prepare_doubt_request, query, session_id, language, embedding)
+    sources = describe_sources(results)
+    yield "metadata", {"session_id": session_id, "language": language, "sources": sources, "cached": False}
+    if messages is None:
+        yield "token", NO_RESULTS_MESSAGE
+        yield "done", {"fallback": False, "cached": False}
+        return
+
+    parts = []
+    sent_any = False
+    try:
+        stream = llm_gateway.astream(messages, temperature=LLM_TEMPERATURE, priority=llm_gateway.PRIORITY_INTERACTIVE)
+        try:
+            async for chunk in stream:
+                if chunk.content:
+                    sent_any = True
+                    parts.append(chunk.content)
+                    yield "token", chunk.content
+        finally:
+            await stream.aclose()
+    except Exception as e:
+        if sent_any:
+            raise
+        print(f"⚠️ Streaming failed before the first token ({e}). Falling back to a single response...")
+        response = await agenerate_ai_response(messages)
+        await run_blocking(answer_cache.store, session_id, language, query, embedding, response.content, sources)
+        yield "token", response.content
+        yield "done", {"fallback": True, "cached": False}
+        return
+    # Only complete answers are cached; a disconnect never reaches this point
+    await run_blocking(answer_cache.store, session_id, language, query, embedding, "".join(parts), sources)
+    yield "done", {"fallback": False, "cached": False}
+
+def get_chunk_assets(chunk_id: str, session_id: Optional[str] = None) -> Optional[Dict]:
+    """
+    Lazily fetches the tables and images of one chunk for the UI.
+    Returns None if the chunk does not exist.
+    """
+    if session_id is None and chunk_id.count(":") >= 2:
+        # Chunk ids are "<session_id>:<file hash>:<index>"
+        session_id = chunk_id.rsplit(":", 2)[0]
+    if session_id is None:
+        if vector_store.VECTOR_LAYOUT != "shared":
+            return None
+        db = vector_store.get_vector_store()
+    else:
+        db = vector_store.get_session_store(session_id, create=False)
+        if db is None:
+            return None
+    results = db.get(ids=[chunk_id], include=["metadatas"])
+    if not results["ids"]:
+        return None
+    metadata = results["metadatas"][0]
+    return {
+        "chunk_id": chunk_id,
+        "source": metadata.get("source"),
+        "parent_topic": metadata.get("parent_topic"),
+        **load_chunk_assets(metadata)
+    }
+
 if __name__ == "__main__":
     pass
@@ -0,0 +1,190 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+
+from ingestion_manifest import manifest_path
+import vector_store
+
+# --- CONFIG ---
+# Optional in-process index for hot sessions: a session's embeddings are pulled out of the
+# shared Chroma collection once and searched as a contiguous NumPy matrix, so /ask skips
+# Chroma's metadata-filtered search. Reloaded when the session's manifest changes.
+SESSION_VECTOR_INDEX = os.getenv("SESSION_VECTOR_INDEX", "0") == "1"
+SESSION_INDEX_DTYPE = os.getenv("SESSION_INDEX_DTYPE", "float32")   # "float32" or "int8"
+SESSION_INDEX_MAX_SESSIONS = int(os.getenv("SESSION_INDEX_MAX_SESSIONS", "16"))
+SESSION_INDEX_MAX_BYTES = int(os.getenv("SESSION_INDEX_MAX_BYTES", str(256 * 1024 * 1024)))
+UPLOAD_ROOT = "uploads"
+
+def _manifest_signature(session_id: str):
+    try:
+        stat = os.stat(manifest_path(os.path.join(UPLOAD_ROOT, session_id)))
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+class SessionIndex:
+    """Row-normalized embeddings of one session (optionally int8 with per-row scales) plus texts."""
+
+    def __init__(self, ids: List[str], embeddings, documents: List[str], metadatas: List[dict],
+                 dtype: str = SESSION_INDEX_DTYPE):
+        import numpy as np
+
+        if len(ids) == 0:
+            matrix = np.zeros((0, 1), dtype=np.float32)   # Empty session: searches return []
+        else:
+            matrix = np.array(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        if dtype == "int8":
+            self.scales = np.maximum(np.abs(matrix).max(axis=1), 1e-12) / 127.0
+            self.matrix = np.round(matrix / self.scales[:, None]).astype(np.int8)
+        else:
+            self.scales = None
+            self.matrix = np.ascontiguousarray(matrix)
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def _rows(self, idx):
+        import numpy as np
+
+        rows = self.matrix[idx].astype(np.float32)
+        if self.scales is not None:
+            rows *= self.scales[idx][:, None]
+        return rows
+
+    def similarities(self, query):
+        """Cosine similarity of the (normalized) query against every chunk."""
+        import numpy as np
+
+        if self.scales is None:
+            return self.matrix @ query
+        return (self.matrix.astype(np.float32) @ query) * self.scales
+
+    def top_k(self, query, k: int):
+        import numpy as np
+
+        scores = self.similarities(query)
+        k = min(k, len(scores))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), scores
+        idx = np.argpartition(-scores, k - 1)[:k]
+        return idx[np.argsort(-scores[idx])], scores
+
+    def mmr(self, query, k: int = 8, fetch_k: int = 20, lambda_mult: float = 0.5) -> List[int]:
+        """Maximal marginal relevance over the top fetch_k candidates, same objective as Chroma's."""
+        import numpy as np
+
+        candidates, scores = self.top_k(query, fetch_k)
+        if len(candidates) == 0:
+            return []
+        relevance = scores[candidates]
+        vectors = self._rows(candidates)
+        pairwise = vectors @ vectors.T
+        selected = [0]   # Most relevant candidate first
+        max_sim = pairwise[0].copy()
+        for _ in range(min(k, len(candidates)) - 1):
+            mmr_scores = lambda_mult * relevance - (1 - lambda_mult) * max_sim
+            mmr_scores[selected] = -np.inf
+            best = int(np.argmax(mmr_scores))
+            selected.append(best)
+            max_sim = np.maximum(max_sim, pairwise[best])
+        return [int(candidates[i]) for i in selected]
+
+    def to_documents(self, rows: List[int]):
+        from langchain_core.documents import Document
+
+        return [Document(id=self.ids[i], page_content=self.documents[i], metadata=self.metadatas[i]) for i in rows]
+
+class SessionIndexRegistry:
+    def __init__(self, max_sessions: int = SESSION_INDEX_MAX_SESSIONS, max_bytes: int = SESSION_INDEX_MAX_BYTES):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._indexes = OrderedDict()   # session_id -> (manifest signature, SessionIndex), LRU order
+        self._stats = {"hits": 0, "loads": 0, "refreshes": 0, "evictions": 0, "load_seconds_total": 0.0}
+
+    def _load(self, session_id: str) -> SessionIndex:
+        start = time.perf_counter()
+        db = vector_store.get_session_store(session_id)
+        results = db.get(where=vector_store.session_filter(session_id), include=["embeddings", "documents", "metadatas"])
+        index = SessionIndex(results["ids"], results["embeddings"], results["documents"], results["metadatas"])
+        elapsed = time.perf_counter() - start
+        self._stats["load_seconds_total"] += elapsed
+        print(f"🧮 Loaded {len(index.ids)} embeddings for session {session_id} ({index.nbytes / 1e6:.1f} MB, {elapsed:.2f}s)")
+        return index
+
+    def _evict(self):
+        """Called with the lock held: drops least recently used sessions over the limits."""
+        total = sum(index.nbytes for _, index in self._indexes.values())
+        while self._indexes and (len(self._indexes) > self.max_sessions or total > self.max_bytes):
+            session_id, (_, index) = self._indexes.popitem(last=False)
+            total -= index.nbytes
+            self._stats["evictions"] += 1
+            print(f"🧹 Evicted in-memory index for session {session_id}")
+
+    def get(self, session_id: str) -> SessionIndex:
+        signature = _manifest_signature(session_id)
+        with self._lock:
+            cached = self._indexes.get(session_id)
+            if cached is not None and cached[0] == signature:
+                self._indexes.move_to_end(session_id)
+                self._stats["hits"] += 1
+                return cached[1]
+            load_lock = self._load_locks.setdefault(session_id, threading.Lock())
+
+        # One loader per session; concurrent requests wait for it instead of loading again
+        with load_lock:
+            with self._lock:
+                cached = self._indexes.get(session_id)
+                if cached is not None and cached[0] == signature:
+                    self._stats["hits"] += 1
+                    return cached[1]
+                refreshing = cached is not None
+            index = self._load(session_id)
+            with self._lock:
+                self._stats["refreshes" if refreshing else "loads"] += 1
+                self._indexes[session_id] = (signature, index)
+                self._indexes.move_to_end(session_id)
+                self._evict()
+            return index
+
+    def invalidate(self, session_id: str):
+        with self._lock:
+            self._indexes.pop(session_id, None)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "enabled": SESSION_VECTOR_INDEX,
+                "dtype": SESSION_INDEX_DTYPE,
+                "sessions": {sid: {"chunks": len(index.ids), "bytes": index.nbytes} for sid, (_, index) in self._indexes.items()},
+                "total_bytes": sum(index.nbytes for _, index in self._indexes.values()),
+            }
+
+registry = SessionIndexRegistry()
+
+def mmr_search(session_id: str, query_embedding: List[float], k: int = 8, fetch_k: int = 20,
+               lambda_mult: float = 0.5):
+    """Drop-in for Chroma's filtered max_marginal_relevance_search_by_vector on one session."""
+    import numpy as np
+
+    index = registry.get(session_id)
+    if not index.ids:
+        return []
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query /= max(float(np.linalg.norm(query)), 1e-12)
+    return index.to_documents(index.mmr(query, k, fetch_k, lambda_mult))
+
+def invalidate(session_id: str):
+    registry.invalidate(session_id)
+
+def get_stats() -> Dict:
+    return registry.get_stats()
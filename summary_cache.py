@@ -0,0 +1,78 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List
+
+# Persistent cache of chunk summaries, keyed by a hash of the chunk's text, tables,
+# images and the model that summarized it. Least-recently-used rows are evicted
+# once the stored summaries exceed SUMMARY_CACHE_MAX_BYTES.
+SUMMARY_CACHE_PATH = os.path.join("data", "summary_cache.sqlite3")
+SUMMARY_CACHE_MAX_BYTES = int(os.getenv("SUMMARY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+_lock = threading.Lock()
+
+def summary_key(content: dict, model: str) -> str:
+    digest = hashlib.sha256()
+    for part in [model, content['text'], *content['tables'], *content['images']]:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def _connect() -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(SUMMARY_CACHE_PATH), exist_ok=True)
+    conn = sqlite3.connect(SUMMARY_CACHE_PATH, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS summaries ("
+        " key TEXT PRIMARY KEY, summary TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_summaries_last_used ON summaries(last_used)")
+    return conn
+
+def get_many(keys: List[str]) -> Dict[str, str]:
+    """Returns the cached summaries among `keys` and marks them as recently used."""
+    if not keys:
+        return {}
+    found = {}
+    with _lock:
+        conn = _connect()
+        try:
+            for i in range(0, len(keys), 500):
+                batch = keys[i : i + 500]
+                rows = conn.execute(
+                    f"SELECT key, summary FROM summaries WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update(rows)
+            now = time.time()
+            conn.executemany("UPDATE summaries SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+            conn.commit()
+        finally:
+            conn.close()
+    return found
+
+def put_many(summaries: Dict[str, str]):
+    """Stores summaries, then evicts least-recently-used rows beyond the size budget."""
+    if not summaries:
+        return
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO summaries (key, summary, size, last_used) VALUES (?, ?, ?, ?)",
+                [(k, v, len(v.encode("utf-8")), now) for k, v in summaries.items()]
+            )
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM summaries").fetchone()[0]
+            if total > SUMMARY_CACHE_MAX_BYTES:
+                evicted = 0
+                for key, size in conn.execute("SELECT key, size FROM summaries ORDER BY last_used ASC").fetchall():
+                    if total <= SUMMARY_CACHE_MAX_BYTES:
+                        break
+                    conn.execute("DELETE FROM summaries WHERE key = ?", (key,))
+                    total -= size
+                    evicted += 1
+                print(f"🧹 Summary cache evicted {evicted} entries")
+            conn.commit()
+        finally:
+            conn.close()
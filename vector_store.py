@@ -0,0 +1,295 @@
+import os
+import re
+import gzip
+import json
+import time
+import hashlib
+import threading
+from typing import Dict, List, Optional
+
+# --- CONFIG ---
+# Single process-wide registry for the embedding model and Chroma collection handles.
+# Everything is created lazily (or by warm_up at startup) and shared by all services.
+CHROMA_PATH = "./chroma_db"
+COLLECTION_NAME = "hackathon_collection"   # Shared collection of the "shared" layout (and pre-sharding data)
+# "per_session": one collection per classroom, no metadata filtering or cross-classroom mixing.
+# "shared": everything in COLLECTION_NAME, filtered by session_id metadata.
+VECTOR_LAYOUT = os.getenv("VECTOR_LAYOUT", "per_session")
+SESSION_COLLECTION_PREFIX = "session-"
+ARCHIVE_ROOT = os.path.join("data", "archive")
+MIGRATE_BATCH_SIZE = 256
+WARM_UP_RETRY_SECONDS = float(os.getenv("WARM_UP_RETRY_SECONDS", "10"))   # Delay before retrying a failed warm-up
+# Using local embeddings to avoid 429 rate limits during bulk upload
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+
+_lock = threading.Lock()
+_embeddings = None
+_client = None
+_stores: Dict[str, object] = {}
+_legacy_checked = set()
+_ready = threading.Event()
+
+# Serializes writes (upserts/deletes) from concurrent ingestion jobs; reads do not take it
+write_lock = threading.RLock()
+
+def get_embeddings():
+    """The shared HuggingFace embedding model, loaded once per process."""
+    global _embeddings
+    if _embeddings is None:
+        with _lock:
+            if _embeddings is None:
+                from langchain_huggingface import HuggingFaceEmbeddings
+                print(f"🧠 Loading embedding model {EMBEDDING_MODEL}")
+                _embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+        _mark_ready_if_loaded()
+    return _embeddings
+
+def get_client():
+    """The process-wide persistent Chroma client behind every collection handle."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import chromadb
+                _client = chromadb.PersistentClient(path=CHROMA_PATH)
+        _mark_ready_if_loaded()
+    return _client
+
+def _mark_ready_if_loaded():
+    # Lazy first use (FAST_BOOT) counts as warmed up once both the model and the client exist
+    if _embeddings is not None and _client is not None:
+        _ready.set()
+
+def get_vector_store(collection_name: str = COLLECTION_NAME):
+    """Shared Chroma handle for a collection; the underlying client is reused across requests."""
+    store = _stores.get(collection_name)
+    if store is None:
+        embeddings = get_embeddings()
+        client = get_client()
+        with _lock:
+            store = _stores.get(collection_name)
+            if store is None:
+                from langchain_chroma import Chroma
+                store = Chroma(
+                    client=client,
+                    embedding_function=embeddings,
+                    collection_name=collection_name
+                )
+                _stores[collection_name] = store
+    return store
+
+def session_collection_name(session_id: str) -> str:
+    """
+    Chroma-safe collection name (3-63 chars of [a-zA-Z0-9._-]) for a classroom. Ids that had
+    to be rewritten get "." plus a hash of the raw id appended; "." never occurs in an id kept
+    as-is, so "Physics 101", "Physics.101" and "Physics-101" never share a collection.
+    """
+    cleaned = re.sub(r"[^a-zA-Z0-9_-]", "-", session_id)
+    if cleaned == session_id and len(SESSION_COLLECTION_PREFIX + cleaned) <= 63 and cleaned[-1:].isalnum():
+        return SESSION_COLLECTION_PREFIX + cleaned
+    digest = hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:16]
+    return f"{SESSION_COLLECTION_PREFIX}{cleaned[:38]}.{digest}"
+
+def _legacy_collection_name(session_id: str) -> str:
+    """Name used before ids were made collision-free; only read to move old chunks over."""
+    name = SESSION_COLLECTION_PREFIX + re.sub(r"[^a-zA-Z0-9_-]", "-", session_id)
+    if len(name) > 63 or not name[-1].isalnum():
+        name = SESSION_COLLECTION_PREFIX + hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:32]
+    return name
+
+def list_collection_names() -> List[str]:
+    # chromadb >= 0.6 returns names, older versions return Collection objects
+    return [getattr(c, "name", c) for c in get_client().list_collections()]
+
+def _has_legacy_chunks(session_id: str, names: List[str]) -> bool:
+    """Cheap probe (one id) for chunks of this session left in the shared or old-named collections."""
+    for name in (COLLECTION_NAME, _legacy_collection_name(session_id)):
+        if name in names and name != session_collection_name(session_id):
+            if get_client().get_collection(name).get(where={"session_id": session_id}, limit=1, include=[])["ids"]:
+                return True
+    return False
+
+def get_session_store(session_id: str, create: bool = True):
+    """
+    The Chroma handle holding a classroom's chunks. In the per-session layout, chunks of
+    this session still sitting in the old shared collection are moved over on first use.
+    Read paths pass create=False: an unknown session id then returns None instead of
+    creating an empty collection.
+    """
+    if VECTOR_LAYOUT == "shared":
+        return get_vector_store()
+    name = session_collection_name(session_id)
+    if not create and name not in _stores:
+        names = list_collection_names()
+        if name not in names and not _has_legacy_chunks(session_id, names):
+            return None
+    if session_id not in _legacy_checked:
+        names = list_collection_names()
+        if COLLECTION_NAME in names:
+            migrate_session(session_id)
+        legacy_name = _legacy_collection_name(session_id)
+        if legacy_name != session_collection_name(session_id) and legacy_name in names:
+            # Collision-prone name from before: only this session's chunks (by metadata) move over
+            migrate_session(session_id, source_collection=legacy_name)
+            if get_client().get_collection(legacy_name).count() == 0:
+                get_client().delete_collection(legacy_name)
+                _stores.pop(legacy_name, None)
+        _legacy_checked.add(session_id)
+    return get_vector_store(session_collection_name(session_id))
+
+def get_session_collection(session_id: str, create: bool = True):
+    """
+    The raw chromadb collection behind get_session_store, for writes that must keep the
+    stored embeddings (metadata updates, archive/restore); None as in get_session_store.
+    """
+    if get_session_store(session_id, create=create) is None:
+        return None
+    name = COLLECTION_NAME if VECTOR_LAYOUT == "shared" else session_collection_name(session_id)
+    return get_client().get_collection(name)
+
+def session_filter(session_id: str) -> Optional[dict]:
+    """Metadata filter still needed to scope queries to a classroom (only in the shared layout)."""
+    return {"session_id": session_id} if VECTOR_LAYOUT == "shared" else None
+
+def _batched_get(collection, where: Optional[dict] = None, include=("embeddings", "documents", "metadatas")):
+    """Reads a (filtered) collection in pages of MIGRATE_BATCH_SIZE."""
+    offset = 0
+    while True:
+        page = collection.get(where=where, include=list(include), limit=MIGRATE_BATCH_SIZE, offset=offset)
+        if not page["ids"]:
+            return
+        yield page
+        offset += len(page["ids"])
+
+def _as_lists(embeddings) -> list:
+    return [list(map(float, e)) for e in embeddings]
+
+def migrate_session(session_id: str, source_collection: str = COLLECTION_NAME, delete_source: bool = True) -> int:
+    """
+    Copies one session's chunks (with their stored embeddings, no re-embedding) from the
+    shared collection into its own collection. Returns the number of chunks moved.
+    """
+    client = get_client()
+    source = client.get_collection(source_collection)
+    target = client.get_or_create_collection(session_collection_name(session_id), metadata={"session_id": session_id})
+    moved = []
+    with write_lock:
+        for page in list(_batched_get(source, where={"session_id": session_id})):
+            target.upsert(ids=page["ids"], embeddings=_as_lists(page["embeddings"]),
+                          documents=page["documents"], metadatas=page["metadatas"])
+            moved.extend(page["ids"])
+        if delete_source and moved:
+            for i in range(0, len(moved), MIGRATE_BATCH_SIZE):
+                source.delete(ids=moved[i : i + MIGRATE_BATCH_SIZE])
+    if moved:
+        print(f"📦 Moved {len(moved)} chunks of session {session_id} into {target.name}")
+    return len(moved)
+
+def drop_session(session_id: str) -> int:
+    """
+    Deletes every chunk of a classroom. In the per-session layout the whole collection
+    (and its HNSW segment files) is dropped, which frees the space immediately, and any
+    of its chunks still left in the shared or old-named collection are deleted too.
+    """
+    with write_lock:
+        if VECTOR_LAYOUT == "shared":
+            store = get_vector_store()
+            ids = store.get(where={"session_id": session_id}, include=[])["ids"]
+            if ids:
+                store.delete(ids=ids)
+            return len(ids)
+        name = session_collection_name(session_id)
+        names = list_collection_names()
+        count = 0
+        if name in names:
+            count = get_client().get_collection(name).count()
+            get_client().delete_collection(name)
+            _stores.pop(name, None)
+        # Chunks never migrated out of the shared or old-named collection would otherwise
+        # be found (and migrated back) on the next read
+        for legacy_name in {COLLECTION_NAME, _legacy_collection_name(session_id)} - {name}:
+            if legacy_name in names:
+                collection = get_client().get_collection(legacy_name)
+                ids = collection.get(where={"session_id": session_id}, include=[])["ids"]
+                for i in range(0, len(ids), MIGRATE_BATCH_SIZE):
+                    collection.delete(ids=ids[i : i + MIGRATE_BATCH_SIZE])
+                count += len(ids)
+        _legacy_checked.discard(session_id)
+        return count
+
+def iter_metadatas():
+    """Metadata of every stored chunk, across all collections and archived classrooms."""
+    for name in list_collection_names():
+        for page in _batched_get(get_client().get_collection(name), include=("metadatas",)):
+            yield from page["metadatas"]
+    if os.path.isdir(ARCHIVE_ROOT):
+        for session_id in os.listdir(ARCHIVE_ROOT):
+            path = archive_path(session_id)
+            if os.path.exists(path):
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    yield from json.load(f)["metadatas"]
+
+def archive_path(session_id: str) -> str:
+    return os.path.join(ARCHIVE_ROOT, session_id, "vectors.json.gz")
+
+def archive_session(session_id: str) -> int:
+    """Exports a classroom's chunks and embeddings to ARCHIVE_ROOT, then drops them from Chroma."""
+    collection = get_session_collection(session_id, create=False)
+    where = session_filter(session_id)
+    data = {"session_id": session_id, "ids": [], "embeddings": [], "documents": [], "metadatas": []}
+    for page in (_batched_get(collection, where=where) if collection is not None else ()):
+        data["ids"].extend(page["ids"])
+        data["embeddings"].extend(_as_lists(page["embeddings"]))
+        data["documents"].extend(page["documents"])
+        data["metadatas"].extend(page["metadatas"])
+    path = archive_path(session_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+    drop_session(session_id)
+    print(f"🗄️ Archived {len(data['ids'])} chunks of session {session_id} to {path}")
+    return len(data["ids"])
+
+def restore_session(session_id: str) -> int:
+    """Re-imports an archived classroom (stored embeddings, no re-embedding) and removes the archive."""
+    path = archive_path(session_id)
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        data = json.load(f)
+    collection = get_session_collection(session_id)
+    with write_lock:
+        for i in range(0, len(data["ids"]), MIGRATE_BATCH_SIZE):
+            window = slice(i, i + MIGRATE_BATCH_SIZE)
+            collection.upsert(ids=data["ids"][window], embeddings=data["embeddings"][window],
+                              documents=data["documents"][window], metadatas=data["metadatas"][window])
+    os.remove(path)
+    print(f"📤 Restored {len(data['ids'])} chunks of session {session_id}")
+    return len(data["ids"])
+
+def warm_up():
+    """
+    Loads the model, runs one embedding and opens the Chroma client (and shared collection).
+    A failure is retried every WARM_UP_RETRY_SECONDS until it succeeds.
+    """
+    while True:
+        try:
+            get_embeddings().embed_query("warm up")
+            if VECTOR_LAYOUT == "shared":
+                get_vector_store()
+            else:
+                get_client()
+            _ready.set()
+            print("✅ Vector store warm-up complete")
+            return
+        except Exception as e:
+            print(f"❌ Vector store warm-up failed, retrying in {WARM_UP_RETRY_SECONDS:.0f}s: {e}")
+            time.sleep(WARM_UP_RETRY_SECONDS)
+
+def start_warm_up() -> threading.Thread:
+    thread = threading.Thread(target=warm_up, name="vector-store-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+def is_ready() -> bool:
+    return _ready.is_set()